@@ -1,11 +1,22 @@
 import streamlit as st
 import pandas as pd
 import requests
-import json
-from io import StringIO
-import sqlite3
-from typing import Dict, List, Any, Optional
-import urllib.parse
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List, Any, Optional, Callable, Iterable
+
+from data_uploader.core import (
+    DEFAULT_BATCH_ROWS, DEFAULT_BATCH_BYTES, DEFAULT_MAX_IN_FLIGHT, ProgressCallback,
+    DEFAULT_POOL_SIZE, make_session, DEFAULT_PREVIEW_ROWS, DEFAULT_CHUNK_ROWS, COMPRESSION_METHODS,
+    DEFAULT_DELETE_CHUNK, MetadataCache, DEFAULT_METRICS_EVENTS, UploadMetrics, DatasetteUploader,
+    DEFAULT_SCHEMA_SAMPLE, SCHEMA_TYPES, infer_schema, LocalSQLiteUploader, run_upload_jobs,
+    JobManager, Uploader, DEFAULT_JOURNAL_PATH, UploadJournal,
+    checkpointed_upload, compute_sync_diff, apply_sync_diff, VALIDATION_ACTIONS, validate_rows,
+    apply_validation, readable_column_types, load_file, preview_file, iter_file_chunks, UPLOAD_TYPES,
+    ParsedFileCache, DEFAULT_SPILL_DIR,
+)
 
 # Configure Streamlit page
 st.set_page_config(
@@ -14,225 +25,271 @@ st.set_page_config(
     layout="wide"
 )
 
-class DatasetteUploader:
-    def __init__(self, base_url: str, token: Optional[str] = None):
-        self.base_url = base_url.rstrip('/')
-        self.token = token
-        self.headers = {}
-        if token:
-            self.headers['Authorization'] = f'Bearer {token}'
-    
-    def get_databases(self) -> List[str]:
-        """Get list of databases from Datasette instance"""
-        try:
-            response = requests.get(f"{self.base_url}/.json")
-            if response.status_code == 200:
-                data = response.json()
-                return list(data.get('databases', {}))
-            return []
-        except Exception as e:
-            st.error(f"Error fetching databases: {e}")
-            return []
-    
-    def get_tables(self, database: str) -> List[str]:
-        """Get list of tables from a specific database"""
-        try:
-            response = requests.get(f"{self.base_url}/{database}.json")
-            if response.status_code == 200:
-                data = response.json()
-                return [table['name'] for table in data.get('tables', [])]
-            return []
-        except Exception as e:
-            st.error(f"Error fetching tables: {e}")
-            return []
-    
-    def get_table_schema(self, database: str, table: str) -> Dict:
-        """Get table schema information"""
-        try:
-            response = requests.get(f"{self.base_url}/{database}/{table}.json?_=schema")
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('rows', [])
-            return []
-        except Exception as e:
-            st.error(f"Error fetching table schema: {e}")
-            return []
-    
-    def create_table(self, database: str, table_name: str, df: pd.DataFrame) -> Dict[str, Any]:
-        """Create a new table with data from DataFrame"""
-        try:
-            # Convert DataFrame to records for JSON payload
-            records = df.to_dict('records')
-            
-            # Create table payload
-            payload = {
-                "table": table_name,
-                "rows": records
-            }
-            
-            # Make API call to create table
-            response = requests.post(
-                f"{self.base_url}/{database}/-/create",
-                headers={**self.headers, 'Content-Type': 'application/json'},
-                json=payload,
-            )
-            
-            return {
-                'success': response.status_code in [200, 201],
-                'status_code': response.status_code,
-                'response': response.text
-            }
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    def insert_rows(self, database: str, table: str, df: pd.DataFrame) -> Dict[str, Any]:
-        """Insert rows into existing table"""
-        try:
-            records = df.to_dict('records')
-            
-            payload = {
-                "rows": records
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/{database}/{table}/-/insert",
-                headers={**self.headers, 'Content-Type': 'application/json'},
-                json=payload
-            )
-            
-            return {
-                'success': response.status_code in [200, 201],
-                'status_code': response.status_code,
-                'response': response.text
-            }
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    def drop_table(self, database: str, table: str, confirm: bool = False) -> Dict[str, Any]:
-        """Drop a table from the given database."""
-        try:
-            url = f"{self.base_url}/{database}/{table}/-/drop"
-            payload = {"confirm": True} if confirm else {}
+JOB_POLL_INTERVAL = 2  # seconds between job panel refreshes
 
-            response = requests.post(
-                url,
-                headers={**self.headers, 'Content-Type': 'application/json'},
-                json=payload
-            )
 
-            return {
-                'success': response.status_code == 200,
-                'status_code': response.status_code,
-                'response': response.json() if response.headers.get("Content-Type") == "application/json" else response.text
-            }
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
+class StreamlitErrorHandler(logging.Handler):
+    """Show errors logged by core (failed listings, unreadable files) inline"""
+    def emit(self, record: logging.LogRecord):
+        st.error(self.format(record))
 
-    def update_rows(self, database: str, table: str, pk_values: List[str], updates: Dict[str, Any], return_row: bool = True) -> Dict[str, Any]:
-        """Update a row in a table by primary key(s)."""
-        try:
-            # Tilde-encode PKs (Datasette requirement)
-            row_pks = ",".join([urllib.parse.quote(pk, safe="") for pk in pk_values])
+@st.cache_resource(show_spinner=False)
+def install_error_handler():
+    """Attach the st.error handler once per process, not on every rerun"""
+    logging.getLogger('data_uploader.core').addHandler(StreamlitErrorHandler())
 
-            url = f"{self.base_url}/{database}/{table}/{row_pks}/-/update"
-            payload = {
-                "update": updates
-            }
-            if return_row:
-                payload["return"] = True
+install_error_handler()
 
-            response = requests.post(
-                url,
-                headers={**self.headers, 'Content-Type': 'application/json'},
-                json=payload
-            )
+@st.cache_resource(show_spinner=False)
+def get_cached_session(base_url: str, token: Optional[str], pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """One pooled session per (base_url, token), kept alive across Streamlit reruns"""
+    return make_session(token, pool_size=pool_size)
 
-            return {
-                "success": response.status_code == 200,
-                "status_code": response.status_code,
-                "response": response.json() if response.headers.get("Content-Type") == "application/json" else response.text
-            }
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+@st.cache_resource(show_spinner=False)
+def get_metadata_cache() -> MetadataCache:
+    """Process-wide metadata cache shared by every session and rerun"""
+    return MetadataCache()
 
+@st.cache_resource(show_spinner=False)
+def get_upload_metrics() -> UploadMetrics:
+    """Process-wide call metrics shared by every session and rerun"""
+    return UploadMetrics()
 
-    def delete_rows(self, database: str, table: str, row_pks: List[Any]) -> Dict[str, Any]:
-        """
-        Delete a row by primary key(s) from a Datasette table.
-        - database: name of the Datasette database
-        - table: table name
-        - row_pks: list of primary key values (single value for single PK, list for composite PK)
-        """
-        try:
-            # Tilde-encode PKs (Datasette requirement: ~ becomes ~~ , / becomes ~s , etc.)
-            def tilde_encode(value: str) -> str:
-                return (
-                    str(value)
-                    .replace("~", "~~")
-                    .replace("/", "~s")
-                    .replace(",", "~c")
-                    .replace("?", "~q")
-                    .replace("#", "~h")
-                )
+@st.cache_resource(show_spinner=False)
+def get_job_manager() -> JobManager:
+    """Process-wide job manager; each browser session only sees its own jobs (see job_owner)"""
+    return JobManager()
 
-            if isinstance(row_pks, (list, tuple)):
-                pk_path = ",".join([tilde_encode(str(pk)) for pk in row_pks])
-            else:
-                pk_path = tilde_encode(str(row_pks))
+@st.cache_resource(show_spinner=False)
+def get_upload_journal(path: str = DEFAULT_JOURNAL_PATH) -> UploadJournal:
+    return UploadJournal(path)
 
-            url = f"{self.base_url}/{database}/{table}/{pk_path}/-/delete"
-            headers = {"Content-Type": "application/json"}
-            if self.token:
-                headers["Authorization"] = f"Bearer {self.token}"
+@st.cache_resource(show_spinner=False)
+def get_parsed_file_cache() -> ParsedFileCache:
+    """Process-wide cache of parsed uploads shared by every session and rerun"""
+    return ParsedFileCache()
 
-            resp = requests.post(url, headers=headers, json={})
-            resp.raise_for_status()
+def job_owner() -> str:
+    """ID of this browser session, which background jobs are filed under"""
+    if 'job_owner' not in st.session_state:
+        st.session_state.job_owner = uuid.uuid4().hex
+    return st.session_state.job_owner
 
-            return resp.json()
+def read_upload(uploaded_file) -> Optional[pd.DataFrame]:
+    """load_file, parsed once per upload content rather than once per rerun"""
+    return get_parsed_file_cache().get_or_parse(uploaded_file, ('load',), lambda: load_file(uploaded_file))
 
-        except Exception as e:
-            return {"ok": False, "error": str(e)}
+def preview_upload(uploaded_file, nrows: int = DEFAULT_PREVIEW_ROWS, as_text: bool = False) -> Optional[pd.DataFrame]:
+    """preview_file through the parsed file cache"""
+    return get_parsed_file_cache().get_or_parse(
+        uploaded_file, ('preview', nrows, as_text), lambda: preview_file(uploaded_file, nrows, as_text)
+    )
 
-    
-    def get_table_rows(self, database: str, table: str) -> pd.DataFrame:
-        """Fetch rows from a table"""
-        try:
-            url = f"{self.base_url}/{database}/{table}.json?_shape=array"
-            response = requests.get(url, headers=self.headers)
-            if response.status_code == 200:
-                data = response.json()
-                return pd.DataFrame(data) if data else pd.DataFrame()
-            else:
-                return pd.DataFrame()
-        except Exception as e:
-            st.error(f"Error fetching table rows: {e}")
-            return pd.DataFrame()
-
-
-def load_file(uploaded_file) -> Optional[pd.DataFrame]:
-    """Load data from uploaded file"""
-    try:
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        elif uploaded_file.name.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(uploaded_file)
-        else:
-            st.error("Unsupported file format. Please upload CSV or Excel files.")
-            return None
-        
-        return df
-    except Exception as e:
-        st.error(f"Error loading file: {e}")
+
+def show_table_preview(uploader: Uploader, database: str, table: str, limit: int = DEFAULT_PREVIEW_ROWS):
+    """Show the first rows of a table and its total row count after a write"""
+    preview = uploader.get_table_rows(database, table, limit=limit)
+    if preview.empty:
+        st.info("No rows found in table or unable to fetch data.")
+        return
+    row_count = uploader.count_rows(database, table)
+    st.write("**Updated Table:**")
+    if row_count is not None:
+        st.caption(f"Showing the first {len(preview):,} of {row_count:,} rows")
+    st.dataframe(preview)
+
+def run_write(
+    label: str,
+    work: Callable[[Optional[ProgressCallback]], Dict[str, Any]],
+    instance: str,
+    source=None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Run a write operation inline with a progress bar, or queue it as a
+    background job when that is enabled in the sidebar (returns None then).
+    """
+    if st.session_state.get('background_jobs'):
+        job_id = get_job_manager().submit(instance, label, work, owner=job_owner())
+        st.info(f"🕒 Started background job `{job_id}`: {label} Follow it under Background Jobs in the sidebar.")
         return None
+    with st.spinner(label):
+        return work(make_progress_callback(label, source))
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_jobs_panel():
+    """Sidebar list of background jobs, refreshed while the page is open"""
+    manager = get_job_manager()
+    owner = job_owner()
+    jobs = manager.jobs(owner)
+    if not jobs:
+        st.caption("No background jobs.")
+        return
+    for job in jobs:
+        done, total = job['rows_done'], job['rows_total']
+        rows = f"{done:,} / {total:,} rows" if total else f"{done:,} rows"
+        st.write(f"`{job['id']}` {job['description']}")
+        if job['status'] in ('queued', 'running'):
+            st.progress(min(done / total, 1.0) if total else 0.0, text=f"{job['status']} • {rows}")
+            if st.button("Cancel", key=f"cancel_{job['id']}"):
+                manager.cancel(job['id'], owner)
+        else:
+            elapsed = (job['finished'] or time.time()) - (job['started'] or job['submitted'])
+            icon = {'succeeded': '✅', 'failed': '❌', 'cancelled': '⏹️'}[job['status']]
+            st.caption(f"{icon} {job['status']} • {rows} • {elapsed:.1f}s")
+            if job['error']:
+                st.caption(f"{job['error']}")
+    if st.button("Clear finished jobs"):
+        manager.clear_finished(owner)
+
+def make_progress_callback(label: str, source=None) -> ProgressCallback:
+    """
+    Return a batch progress callback that drives a Streamlit progress bar.
+    When rows are streamed (total unknown) and source is the uploaded file,
+    progress is estimated from how far into the file the reader has got.
+    """
+    bar = st.progress(0.0, text=label)
+
+    def update(done: int, total: Optional[int], batch: Dict[str, Any]):
+        if total is not None:
+            fraction = done / total if total else 1.0
+            bar.progress(min(fraction, 1.0), text=f"{label} {done:,} / {total:,} rows")
+        else:
+            fraction = source.tell() / source.size if source is not None and source.size else 0.0
+            bar.progress(min(fraction, 1.0), text=f"{label} {done:,} rows")
+
+    return update
+
+def edit_schema(uploaded_file) -> Dict[str, Any]:
+    """
+    Show the schema inferred from the start of an upload in an editable
+    table and return it with the user's changes. Inference runs once per
+    file and is kept in session state across reruns.
+    """
+    key = f"schema_{uploaded_file.file_id}"
+    if key not in st.session_state:
+        sample = preview_upload(uploaded_file, DEFAULT_SCHEMA_SAMPLE, as_text=True)
+        st.session_state[key] = infer_schema(sample if sample is not None else pd.DataFrame())
+    inferred = st.session_state[key]
+    edited = st.data_editor(
+        pd.DataFrame(inferred['columns'], columns=['name', 'type', 'not_null']),
+        column_config={
+            'name': st.column_config.TextColumn("Column", disabled=True),
+            'type': st.column_config.SelectboxColumn("Type", options=SCHEMA_TYPES, required=True),
+            'not_null': st.column_config.CheckboxColumn("Not null"),
+        },
+        hide_index=True,
+        key=f"{key}_editor",
+    )
+    return {'columns': edited.to_dict('records'), 'pk': inferred['pk']}
+
+def show_validation(report: Dict[str, Any], key: str) -> str:
+    """Summarize a validate_rows report and return the chosen action ('ok' if there is nothing to fix)"""
+    if report['valid']:
+        st.success(f"✅ No problems found in {report['rows']:,} rows")
+        return 'ok'
+    if report['unknown_columns']:
+        st.warning(f"Columns not in the table (will not be uploaded): {', '.join(report['unknown_columns'])}")
+    if report['counts']:
+        st.warning(
+            f"{len(report['bad_rows']):,} of {report['rows']:,} rows have problems: "
+            + ", ".join(f"{count:,} {problem}" for problem, count in report['counts'].items())
+        )
+        st.dataframe(report['issues'], hide_index=True)
+    if report['missing_columns']:
+        st.caption(f"Table columns not in the file: {', '.join(report['missing_columns'])}")
+    if not len(report['bad_rows']):
+        return 'skip'
+    return st.radio(
+        "Rows with problems", list(VALIDATION_ACTIONS),
+        format_func=VALIDATION_ACTIONS.get, key=f"{key}_action"
+    )
+
+def upload_work(
+    uploader: Uploader,
+    instance: str,
+    database: str,
+    table: str,
+    mode: str,
+    uploaded_file,
+    make_chunks: Callable[[], Iterable[pd.DataFrame]],
+    pk: Optional[List[str]] = None,
+    columns: Optional[List[Dict[str, Any]]] = None,
+) -> Callable[[ProgressCallback], Dict[str, Any]]:
+    """
+    Build the work function for a create/insert, going through the upload
+    journal when checkpointing is enabled so a failed upload of the same
+    file can pick up where it stopped.
+    """
+    if not st.session_state.get('checkpoint_uploads'):
+        if mode == 'create':
+            return lambda progress: uploader.create_table(database, table, make_chunks(), progress=progress, pk=pk, columns=columns)
+        return lambda progress: uploader.insert_rows(database, table, make_chunks(), progress=progress)
+
+    journal = get_upload_journal()
+    # Memoized per upload, so reruns don't hash the whole file again
+    fingerprint = get_parsed_file_cache().digest(uploaded_file)
+    entry = journal.find(fingerprint, instance, database, table)
+    if journal.is_running(fingerprint, instance, database, table):
+        st.warning("This file is already being uploaded to this table; starting again will fail until that upload finishes.")
+    elif entry and entry['committed_rows']:
+        st.info(
+            f"A previous upload of this file stopped after {entry['committed_rows']:,} rows; "
+            "it will resume from there."
+        )
+        if st.button("Start over instead"):
+            journal.discard(entry['id'])
+            st.rerun()
+    return lambda progress: checkpointed_upload(
+        uploader, journal, fingerprint, instance, database, table, mode,
+        make_chunks(), progress=progress, pk=pk, columns=columns
+    )
+
+def reporting_parse_errors(work: Callable[[ProgressCallback], Dict[str, Any]]) -> Callable[[ProgressCallback], Dict[str, Any]]:
+    """Turn a value the table's column types can't parse into a failed result instead of a traceback"""
+    def run(progress):
+        try:
+            return work(progress)
+        except ValueError as e:
+            return {
+                'success': False,
+                'error': f"{e}. Validate the file against the table to find these values, "
+                         "or untick 'Parse columns using the table's column types'.",
+            }
+    return run
+
+def show_performance_panel(metrics: UploadMetrics):
+    """Per-call latency, phase and volume summary with export and reset controls"""
+    summary = metrics.summary()
+    if summary.empty:
+        st.caption("No API calls recorded yet")
+        return
+    st.caption(f"Since {time.strftime('%H:%M:%S', time.localtime(metrics.started))}; percentiles over the last {DEFAULT_METRICS_EVENTS:,} calls")
+    st.dataframe(summary, hide_index=True)
+    st.download_button("Prometheus metrics", metrics.to_prometheus(), file_name="uploader_metrics.prom", mime="text/plain")
+    st.download_button("Recent calls (JSON lines)", metrics.to_json_lines(), file_name="uploader_calls.jsonl", mime="application/x-ndjson")
+    if st.button("Reset metrics"):
+        metrics.reset()
+        st.rerun()
+
+def show_write_stats(result: Dict[str, Any]):
+    """Show throughput and any failed batch ranges for a bulk write result"""
+    if not result.get('batches'):
+        return
+    wire = f"{result['bytes_per_sec'] / 1024:,.0f} KB/s"
+    if result.get('raw_bytes', result['bytes_sent']) != result['bytes_sent']:
+        wire += (
+            f" • {result['raw_bytes'] / 1024 ** 2:,.1f} MB JSON sent as {result['bytes_sent'] / 1024 ** 2:,.1f} MB "
+            f"({result['compression_ratio']:.1f}x smaller)"
+        )
+    st.caption(
+        f"{result['rows_written']:,} rows in {result['batches']} batches, "
+        f"{result['elapsed']:.1f}s • {result['rows_per_sec']:,.0f} rows/s • {wire}"
+    )
+    if result.get('warning'):
+        st.warning(result['warning'])
+    if result.get('failed_batches'):
+        st.write("**Failed batches:**")
+        st.dataframe(pd.DataFrame(result['failed_batches']))
 
 def main():
     st.title("📊 Datasette Data Uploader")
@@ -240,42 +297,149 @@ def main():
     
     # Sidebar for configuration
     st.sidebar.header("Configuration")
-    
-    # Initialize session state for persistent URL
-    if 'datasette_url' not in st.session_state:
-        st.session_state.datasette_url = ""
-    if 'token' not in st.session_state:
-        st.session_state.token = ""
-    
-    # URL input with session state
-    datasette_url = st.sidebar.text_input(
-        "Datasette Instance URL",
-        value=st.session_state.datasette_url,
-        placeholder="https://your-datasette-instance.com",
-        help="Enter the base URL of your Datasette instance"
+
+    backend = st.sidebar.radio(
+        "Backend",
+        ["HTTP API", "Local file"],
+        horizontal=True,
+        help="'Local file' writes directly to SQLite files on this machine, bypassing the Datasette write API"
     )
-    
-    # Update session state
-    if datasette_url:
-        st.session_state.datasette_url = datasette_url
-    
-    # Token input (optional)
-    token = st.sidebar.text_input(
-        "API Token (optional)",
-        value=st.session_state.token,
-        type="password",
-        help="Enter your Datasette API token if authentication is required"
+
+    with st.sidebar.expander("Upload Tuning"):
+        chunk_rows = st.number_input(
+            "Rows per file chunk", min_value=1000, value=DEFAULT_CHUNK_ROWS, step=10_000,
+            help="Uploads are parsed this many rows at a time to bound memory use"
+        )
+        csv_engine = st.selectbox(
+            "CSV parser", ["pandas", "pyarrow"],
+            help="pyarrow parses CSV with multiple threads"
+        )
+        if backend == "HTTP API":
+            batch_rows = st.number_input(
+                "Rows per batch", min_value=1, value=DEFAULT_BATCH_ROWS,
+                help="Must not exceed the instance's max_insert_rows setting"
+            )
+            compression = st.selectbox(
+                "Compress request bodies", ["off", *COMPRESSION_METHODS],
+                help="Sends batches with Content-Encoding. Only helps when the server or a proxy in front of it "
+                     "decodes compressed requests; if it does not, the upload falls back to plain JSON"
+            )
+            batch_mb = st.number_input(
+                "Max batch size (MB)", min_value=0.1, value=DEFAULT_BATCH_BYTES / (1024 * 1024), step=0.5,
+                help="Measured after compression when compression is on"
+            )
+            max_in_flight = st.number_input(
+                "Concurrent requests", min_value=1, max_value=32, value=DEFAULT_MAX_IN_FLIGHT,
+                help="Upper bound on write requests in flight at once"
+            )
+            pool_size = st.number_input(
+                "Connection pool size", min_value=1, max_value=64, value=DEFAULT_POOL_SIZE,
+                help="Keep-alive connections kept open to the instance"
+            )
+        else:
+            defer_indexes = st.checkbox(
+                "Rebuild indexes after loading", value=True,
+                help="Drops non-unique indexes before inserting and recreates them afterwards"
+            )
+
+    if backend == "Local file":
+        db_directory = st.sidebar.text_input(
+            "Database directory",
+            value=os.environ.get("DATA_UPLOADER_DB_DIR", ""),
+            help="Directory containing the .db files to write to (default: $DATA_UPLOADER_DB_DIR)"
+        )
+        if not os.path.isdir(db_directory):
+            st.warning("Please enter an existing directory containing SQLite database files.")
+            return
+        uploader = LocalSQLiteUploader(db_directory, defer_indexes=defer_indexes)
+        instance = os.path.abspath(db_directory)
+    else:
+        # Initialize session state for persistent URL
+        if 'datasette_url' not in st.session_state:
+            st.session_state.datasette_url = ""
+        if 'token' not in st.session_state:
+            st.session_state.token = ""
+        
+        # URL input with session state
+        datasette_url = st.sidebar.text_input(
+            "Datasette Instance URL",
+            value=st.session_state.datasette_url,
+            placeholder="https://your-datasette-instance.com",
+            help="Enter the base URL of your Datasette instance"
+        )
+        
+        # Update session state
+        if datasette_url:
+            st.session_state.datasette_url = datasette_url
+        
+        # Token input (optional)
+        token = st.sidebar.text_input(
+            "API Token (optional)",
+            value=st.session_state.token,
+            type="password",
+            help="Enter your Datasette API token if authentication is required"
+        )
+        
+        if token:
+            st.session_state.token = token
+        
+        if not datasette_url:
+            st.warning("Please enter your Datasette instance URL in the sidebar to get started.")
+            return
+
+        # Initialize uploader
+        uploader = DatasetteUploader(
+            datasette_url,
+            token if token else None,
+            batch_rows=batch_rows,
+            batch_bytes=int(batch_mb * 1024 * 1024),
+            max_in_flight=max_in_flight,
+            session=get_cached_session(datasette_url.rstrip('/'), token or None, max(pool_size, max_in_flight)),
+            metadata_cache=get_metadata_cache(),
+            compression=None if compression == "off" else compression,
+            metrics=get_upload_metrics(),
+        )
+
+        with st.sidebar.expander("Metadata Cache"):
+            cache_stats = uploader.metadata_cache.stats()
+            st.caption(
+                f"{cache_stats['hits']} hits • {cache_stats['misses']} misses • "
+                f"{cache_stats['revalidated']} revalidated • {cache_stats['entries']} cached"
+            )
+            if st.button("Refresh metadata"):
+                uploader.invalidate_metadata()
+        with st.sidebar.expander("Performance"):
+            show_performance_panel(uploader.metrics)
+        instance = uploader.base_url
+
+    parsed_cache = get_parsed_file_cache()
+    with st.sidebar.expander("Parsed File Cache"):
+        spill = st.checkbox(
+            "Spill to disk", key="parse_spill",
+            help=f"Parsed files evicted from memory are kept as Arrow files in {DEFAULT_SPILL_DIR} instead of being parsed again"
+        )
+        parsed_cache.spill_dir = DEFAULT_SPILL_DIR if spill else None
+        parse_stats = parsed_cache.stats()
+        st.caption(
+            f"{parse_stats['hits']} hits • {parse_stats['disk_hits']} from disk • {parse_stats['misses']} parsed • "
+            f"{parse_stats['entries']} in memory ({parse_stats['bytes'] / 1e6:,.1f} MB) • "
+            f"{parse_stats['spilled_entries']} on disk ({parse_stats['spilled_bytes'] / 1e6:,.1f} MB)"
+        )
+        if st.button("Clear parsed files"):
+            parsed_cache.clear()
+
+    st.sidebar.checkbox(
+        "Run writes as background jobs",
+        key="background_jobs",
+        help="Long uploads keep running while you use the rest of the app; progress is shown below"
     )
-    
-    if token:
-        st.session_state.token = token
-    
-    if not datasette_url:
-        st.warning("Please enter your Datasette instance URL in the sidebar to get started.")
-        return
-    
-    # Initialize uploader
-    uploader = DatasetteUploader(datasette_url, token if token else None)
+    st.sidebar.checkbox(
+        "Checkpoint uploads (resume after failure)",
+        key="checkpoint_uploads",
+        help="Records progress in a local journal so re-uploading the same file to the same table continues after the last committed batch"
+    )
+    with st.sidebar.expander("Background Jobs", expanded=True):
+        show_jobs_panel()
     
     # Main operation selection
     st.header("Select Operation")
@@ -285,7 +449,9 @@ def main():
         [
             "Create New Table",
             "Insert Rows to Existing Table",
+            "Upload Multiple Files",
             "Update Rows",
+            "Sync Table from File",
             "Drop Table",
             "Delete Rows"
         ]
@@ -307,26 +473,53 @@ def main():
         
         uploaded_file = st.file_uploader(
             "Upload Data File",
-            type=['csv', 'xlsx', 'xls'],
-            help="Upload a CSV or Excel file containing the data for your new table"
+            type=UPLOAD_TYPES,
+            help="Upload a CSV, Excel, Parquet, Arrow/Feather or JSON Lines file containing the data for your new table"
         )
         
         if uploaded_file and table_name:
-            df = load_file(uploaded_file)
-            if df is not None:
+            preview = preview_upload(uploaded_file)
+            if preview is not None:
                 st.write("**Preview of data to be uploaded:**")
-                st.dataframe(df.head())
-                st.write(f"Total rows: {len(df)}")
+                st.dataframe(preview.head())
+                st.write(f"File size: {uploaded_file.size / (1024 * 1024):,.1f} MB")
+                use_schema = st.checkbox(
+                    "Set column types before creating", value=True,
+                    help=f"Types, primary key and not-null columns are inferred from the first {DEFAULT_SCHEMA_SAMPLE:,} rows; "
+                         "edit them below. Not-null is only enforced by the local file backend."
+                )
+                schema = None
+                if use_schema:
+                    schema = edit_schema(uploaded_file)
+                pk = st.multiselect(
+                    "Primary key (optional)", list(preview.columns),
+                    default=schema['pk'] if schema else None,
+                    help="Without a primary key Datasette adds a rowid; a key also lets a resumed upload replace rows instead of duplicating them"
+                )
+                # Text columns are read as strings so codes keep their leading zeros
+                text_types = {col['name']: 'TEXT' for col in schema['columns'] if col['type'] == 'text'} if schema else None
+                work = upload_work(
+                    uploader, instance, database, table_name, 'create', uploaded_file,
+                    lambda: iter_file_chunks(uploaded_file, chunk_rows, csv_engine, text_types),
+                    pk=pk or None,
+                    columns=schema['columns'] if schema else None,
+                )
                 
                 if st.button("Create Table", type="primary"):
-                    with st.spinner("Creating table..."):
-                        result = uploader.create_table(database, table_name, df)
-                    
-                    if result.get('success'):
-                        st.success(f"✅ Table '{table_name}' created successfully!")
-                        # st.info(f"You can view your table at: {datasette_url}/{database}/{table_name}")
-                    else:
-                        st.error(f"❌ Failed to create table: {result.get('error', result.get('response', 'Unknown error'))}")
+                    result = run_write(
+                        f"Creating table '{table_name}'...",
+                        work,
+                        instance,
+                        uploaded_file,
+                    )
+                    if result is not None:
+                        show_write_stats(result)
+                        
+                        if result.get('success'):
+                            st.success(f"✅ Table '{table_name}' created successfully!")
+                            # st.info(f"You can view your table at: {datasette_url}/{database}/{table_name}")
+                        else:
+                            st.error(f"❌ Failed to create table: {result.get('error', result.get('response', 'Unknown error'))}")
     
     elif operation == "Insert Rows to Existing Table":
         st.subheader("➕ Insert Rows to Existing Table")
@@ -356,16 +549,28 @@ def main():
         
         uploaded_file = st.file_uploader(
             "Upload Data File",
-            type=['csv', 'xlsx', 'xls'],
-            help="Upload a CSV or Excel file containing the rows to insert"
+            type=UPLOAD_TYPES,
+            help="Upload a CSV, Excel, Parquet, Arrow/Feather or JSON Lines file containing the rows to insert"
         )
         
         if uploaded_file and table:
-            df = load_file(uploaded_file)
-            if df is not None:
+            preview = preview_upload(uploaded_file)
+            if preview is not None:
                 st.write("**Preview of data to be inserted:**")
-                st.dataframe(df.head())
-                st.write(f"Total rows to insert: {len(df)}")
+                st.dataframe(preview.head())
+                st.write(f"File size: {uploaded_file.size / (1024 * 1024):,.1f} MB")
+                use_table_types = st.checkbox(
+                    "Parse columns using the table's column types", value=True,
+                    help="Keeps e.g. TEXT codes with leading zeros intact; untick if the file has values the column types can't hold"
+                )
+                table_columns = {col['name'] for col in uploader.get_table_columns(database, table)}
+                extra_columns = [col for col in preview.columns if table_columns and col not in table_columns]
+                columns = None
+                if extra_columns and st.checkbox(
+                    f"Skip the {len(extra_columns)} file column(s) the table doesn't have", value=True,
+                    help=f"These columns are never parsed or sent: {', '.join(map(str, extra_columns))}"
+                ):
+                    columns = [col for col in preview.columns if col in table_columns]
                 
                 # Show table schema for reference
                 # schema = uploader.get_table_schema(database, table)
@@ -374,20 +579,129 @@ def main():
                 #     col_names = [col['name'] for col in schema]
                 #     st.write(", ".join(col_names))
                 
-                if st.button("Insert Rows", type="primary"):
-                    with st.spinner("Inserting rows..."):
-                        result = uploader.insert_rows(database, table, df)
-                    
-                    if result.get('success'):
-                        st.success(f"✅ Successfully inserted {len(df)} rows into '{table}'!")
-                        # st.info(f"View updated table at: {datasette_url}/{database}/{table}")
-                        updated_df = uploader.get_table_rows(database, table)
-                        if not updated_df.empty:
-                            st.write("**Updated Table:**")
-                            st.dataframe(updated_df)
-                    else:
-                        st.error(f"❌ Failed to insert rows: {result.get('error', result.get('response', 'Unknown error'))}")
+                column_types = uploader.get_column_types(database, table) if use_table_types else {}
+
+                # Checking the file locally first avoids sending batches the table will reject.
+                # Numeric hints would make the parse fail on the very values validation reports
+                validation_key = f"validation_{instance}_{database}_{table}_{uploaded_file.file_id}_{use_table_types}_{columns is not None}"
+                if st.button("Validate file against table"):
+                    with st.spinner("Validating rows..."):
+                        st.session_state[validation_key] = validate_rows(
+                            iter_file_chunks(uploaded_file, chunk_rows, csv_engine, readable_column_types(column_types), columns=columns),
+                            uploader.get_table_columns(database, table),
+                        )
+                report = st.session_state.get(validation_key)
+                action = show_validation(report, validation_key) if report else 'ok'
+                if report:
+                    column_types = readable_column_types(column_types, report)
+
+                def read_chunks():
+                    chunks = iter_file_chunks(uploaded_file, chunk_rows, csv_engine, column_types or None, columns=columns)
+                    return apply_validation(chunks, report, action) if action not in ('ok', 'stop') else chunks
+
+                work = upload_work(uploader, instance, database, table, 'insert', uploaded_file, read_chunks)
+                if use_table_types:
+                    work = reporting_parse_errors(work)
+                
+                if st.button("Insert Rows", type="primary", disabled=action == 'stop'):
+                    result = run_write(
+                        f"Inserting rows into '{table}'...",
+                        work,
+                        instance,
+                        uploaded_file,
+                    )
+                    if result is not None:
+                        show_write_stats(result)
+                        
+                        if result.get('success'):
+                            st.success(f"✅ Successfully inserted {result['rows_written']:,} rows into '{table}'!")
+                            # st.info(f"View updated table at: {datasette_url}/{database}/{table}")
+                            show_table_preview(uploader, database, table)
+                        else:
+                            st.error(f"❌ Failed to insert rows: {result.get('error', result.get('response', 'Unknown error'))}")
     
+    elif operation == "Upload Multiple Files":
+        st.subheader("📚 Upload Multiple Files")
+
+        databases = uploader.get_databases()
+        if not databases:
+            st.error("Could not fetch databases. Please check your Datasette URL and connection.")
+            return
+
+        database = st.selectbox("Select Database", databases)
+        existing_tables = set(uploader.get_tables(database))
+
+        uploaded_files = st.file_uploader(
+            "Upload Data Files",
+            type=UPLOAD_TYPES,
+            accept_multiple_files=True,
+            help="Each file is uploaded to its own table; files run concurrently"
+        )
+
+        if uploaded_files:
+            jobs = []
+            for uploaded_file in uploaded_files:
+                table = st.text_input(
+                    f"Table for {uploaded_file.name}",
+                    value=os.path.splitext(uploaded_file.name)[0],
+                    key=f"job_table_{uploaded_file.name}"
+                )
+                mode = 'insert' if table in existing_tables else 'create'
+                st.caption("Rows will be appended to the existing table" if mode == 'insert' else "A new table will be created")
+                jobs.append({'file': uploaded_file, 'database': database, 'table': table, 'mode': mode})
+
+            if st.button("Upload All", type="primary"):
+                if st.session_state.get('background_jobs'):
+                    # One job per file; the job manager caps how many run at once per instance
+                    for job in jobs:
+                        write = uploader.create_table if job['mode'] == 'create' else uploader.insert_rows
+                        run_write(
+                            f"Uploading {job['file'].name} to '{job['table']}'...",
+                            lambda progress, job=job, write=write: write(
+                                database, job['table'],
+                                iter_file_chunks(job['file'], chunk_rows, csv_engine),
+                                progress=progress
+                            ),
+                            instance,
+                        )
+                else:
+                    callbacks = [
+                        make_progress_callback(f"{job['file'].name} → {job['table']}", job['file'])
+                        for job in jobs
+                    ]
+                    for job in jobs:
+                        job['data'] = iter_file_chunks(job['file'], chunk_rows, csv_engine)
+
+                    with st.spinner(f"Uploading {len(jobs)} files..."):
+                        if isinstance(uploader, DatasetteUploader):
+                            results = run_upload_jobs(
+                                uploader.base_url,
+                                uploader.token,
+                                jobs,
+                                progress=lambda index, done, total, batch: callbacks[index](done, total, batch),
+                                batch_rows=uploader.batch_rows,
+                                batch_bytes=uploader.batch_bytes,
+                                max_in_flight=uploader.max_in_flight,
+                                compression=uploader.compression,
+                                metrics=uploader.metrics,
+                            )
+                            uploader.invalidate_metadata(database)
+                        else:
+                            # Local writes are CPU/disk bound, so jobs run one after another
+                            results = [
+                                (uploader.create_table if job['mode'] == 'create' else uploader.insert_rows)(
+                                    database, job['table'], job['data'], progress=callback
+                                )
+                                for job, callback in zip(jobs, callbacks)
+                            ]
+
+                    for job, result in zip(jobs, results):
+                        if result.get('success'):
+                            st.success(f"✅ {job['file'].name}: {result['rows_written']:,} rows written to '{job['table']}'")
+                        else:
+                            st.error(f"❌ {job['file'].name}: {result.get('error', result.get('response', 'Unknown error'))}")
+                        show_write_stats(result)
+
     elif operation == "Drop Table":
         st.subheader("🗑️ Drop Table")
         st.warning("⚠️ This operation will permanently delete the table and all its data!")
@@ -439,47 +753,150 @@ def main():
                 col_names = schema_df['name'].tolist() if 'name' in schema_df else schema_df.columns.tolist()
 
                 uploaded_file = st.file_uploader(
-                    "Upload CSV/Excel with updated rows (must include primary key columns)",
-                    type=['csv', 'xlsx', 'xls']
+                    "Upload a data file with updated rows (must include primary key columns)",
+                    type=UPLOAD_TYPES
                 )
 
                 pk_cols = st.multiselect("Select Primary Key Columns", col_names)
 
                 if uploaded_file and pk_cols:
-                    df = load_file(uploaded_file)
+                    df = read_upload(uploaded_file)
                     if df is not None:
                         st.write("Preview of updates:")
                         st.dataframe(df.head())
 
-                        if st.button("Update Rows", type="primary"):
-                            with st.spinner("Updating rows..."):
-                                all_success = True
-                                errors = []
-                                
-                                # Loop over each record and update individually
-                                for _, row in df.iterrows():
-                                    pk_values = [str(row[pk]) for pk in pk_cols]  # ensure strings
-                                    updates = row.drop(labels=pk_cols).to_dict() # rest of the row
-                                    
-                                    result = uploader.update_rows(database, table, pk_values, updates)
-                                    if not result.get("success"):
-                                        all_success = False
-                                        errors.append(result)
-
-                                if all_success:
+                        # Kept across reruns along with the parsed file, so toggling a widget doesn't re-validate
+                        report_key = f"update_report_{instance}_{database}_{table}_{uploaded_file.file_id}_{pk_cols}"
+                        if report_key not in st.session_state:
+                            st.session_state[report_key] = validate_rows([df], uploader.get_table_columns(database, table), pk_cols)
+                        report = st.session_state[report_key]
+                        action = show_validation(report, f"update_validation_{table}")
+                        if action not in ('ok', 'stop'):
+                            df = pd.concat(apply_validation([df], report, action))
+
+                        use_upsert = st.checkbox(
+                            "Send as upsert batches",
+                            help="Much faster for large files, but rows whose primary key does not exist will be inserted"
+                        )
+                        staged = False
+                        if isinstance(uploader, DatasetteUploader):
+                            staged = st.checkbox(
+                                "Stage and apply with one UPDATE statement (datasette-write)",
+                                disabled=use_upsert,
+                                help="Uploads the rows to a temporary staging table in batches, applies them with a single "
+                                     "UPDATE ... FROM and drops the staging table; needs create-table and datasette-write "
+                                     "permissions and only reports totals"
+                            )
+
+                        if st.button("Update Rows", type="primary", disabled=action == 'stop'):
+                            result = run_write(
+                                f"Updating rows in '{table}'...",
+                                lambda progress: uploader.bulk_update(
+                                    database, table, df, pk_cols,
+                                    use_upsert=use_upsert,
+                                    progress=progress,
+                                    staged=staged and not use_upsert
+                                ),
+                                instance,
+                            )
+
+                            if result is not None:
+                                st.caption(
+                                    f"{result['rows_updated']:,} of {result['rows_total']:,} rows updated in "
+                                    f"{result['elapsed']:.1f}s • {result['rows_per_sec']:,.0f} rows/s"
+                                    + (f" • {result['rows_missing']:,} keys not found" if 'rows_missing' in result else "")
+                                )
+                                if result.get('success'):
                                     st.success("✅ All rows updated successfully!")
                                     # Show updated table
-                                    updated_df = uploader.get_table_rows(database, table)
-                                    if not updated_df.empty:
-                                        st.write("**Updated Table:**")
-                                        st.dataframe(updated_df)
-                                    else:
-                                        st.info("No rows found in table or unable to fetch data.")
+                                    show_table_preview(uploader, database, table)
                                 else:
-                                    st.error(f"❌ Some updates failed: {errors}")
+                                    st.error(f"❌ {result['error']}")
+                                    status = result['status']
+                                    st.dataframe(status[~status['success']])
 
 
     
+    elif operation == "Sync Table from File":
+        st.subheader("🔄 Sync Table from File")
+        st.caption("Compares the file with the table and sends only new, changed and (optionally) removed rows")
+
+        databases = uploader.get_databases()
+        if not databases:
+            st.error("Could not fetch databases.")
+            return
+
+        database = st.selectbox("Select Database", databases)
+        tables = uploader.get_tables(database) if database else []
+        if not tables:
+            st.warning("No tables found in the selected database.")
+            return
+
+        table = st.selectbox("Select Table", tables)
+        schema = uploader.get_table_schema(database, table)
+        schema_df = pd.DataFrame(schema)
+        col_names = schema_df['name'].tolist() if 'name' in schema_df else schema_df.columns.tolist()
+
+        uploaded_file = st.file_uploader(
+            "Upload a data file with the full contents the table should have",
+            type=UPLOAD_TYPES
+        )
+        pk_cols = st.multiselect("Select Primary Key Columns", col_names)
+        delete_missing = st.checkbox("Delete table rows that are not in the file")
+
+        if uploaded_file and pk_cols:
+            sync_key = (instance, database, table, uploaded_file.file_id, tuple(pk_cols))
+            if st.button("Compare"):
+                with st.spinner("Comparing file with table..."):
+                    column_types = uploader.get_column_types(database, table)
+                    df = pd.concat(
+                        iter_file_chunks(uploaded_file, chunk_rows, csv_engine, column_types),
+                        ignore_index=True
+                    )
+                    st.session_state['sync_diff'] = (sync_key, compute_sync_diff(uploader, database, table, df, pk_cols))
+
+            stored = st.session_state.get('sync_diff')
+            if stored and stored[0] == sync_key:
+                diff = stored[1]
+                cols = st.columns(4)
+                cols[0].metric("New rows", f"{len(diff['inserts']):,}")
+                cols[1].metric("Changed rows", f"{len(diff['updates']):,}")
+                cols[2].metric("Rows not in file", f"{len(diff['deletes']):,}")
+                cols[3].metric("Unchanged rows", f"{diff['unchanged']:,}")
+                st.caption(
+                    f"Compared with {diff['rows_scanned']:,} table rows in {diff['elapsed']:.1f}s"
+                    + (f" • {diff['duplicate_keys']:,} duplicate keys in the file (last one kept)" if diff['duplicate_keys'] else "")
+                )
+                for label, key in (("New rows", 'inserts'), ("Changed rows", 'updates'), ("Rows not in file", 'deletes')):
+                    if len(diff[key]):
+                        with st.expander(label):
+                            st.dataframe(diff[key].head(DEFAULT_PREVIEW_ROWS))
+
+                pending = len(diff['inserts']) + len(diff['updates']) + (len(diff['deletes']) if delete_missing else 0)
+                if not pending:
+                    st.success("✅ Table is already in sync with the file")
+                elif st.button("Apply changes", type="primary"):
+                    result = run_write(
+                        f"Syncing '{table}'...",
+                        lambda progress: apply_sync_diff(
+                            uploader, database, table, diff, pk_cols,
+                            delete_missing=delete_missing,
+                            progress=progress
+                        ),
+                        instance,
+                    )
+                    if result is not None:
+                        del st.session_state['sync_diff']
+                        st.caption(
+                            f"{result['rows_inserted']:,} inserted • {result['rows_updated']:,} updated • "
+                            f"{result['rows_deleted']:,} deleted in {result['elapsed']:.1f}s"
+                        )
+                        if result.get('success'):
+                            st.success("✅ Table synced successfully!")
+                            show_table_preview(uploader, database, table)
+                        else:
+                            st.error(f"❌ {result['error']}")
+
     elif operation == "Delete Rows":
         st.subheader("🗑️ Delete Rows from Table")
 
@@ -506,7 +923,9 @@ def main():
                 # Pick PK columns (order matters!)
                 pk_cols = st.multiselect("Select Primary Key Columns", col_names)
 
-                if pk_cols:
+                delete_mode = st.radio("Delete", ["Single row", "Rows listed in a key file"], horizontal=True)
+
+                if pk_cols and delete_mode == "Single row":
                     st.write("Enter values for the primary key(s) of the row you want to delete:")
 
                     # Input boxes for each PK column
@@ -527,15 +946,65 @@ def main():
                                 st.success("✅ Row deleted successfully!")
 
                                 # Show updated table
-                                updated_df = uploader.get_table_rows(database, table)
-                                if isinstance(updated_df, pd.DataFrame):
-                                    st.write("**Updated Table:**")
-                                    st.dataframe(updated_df)
-                                else:
-                                    st.warning("Could not fetch updated table.")
+                                show_table_preview(uploader, database, table)
                             else:
                                 st.error(f"❌ Failed: {result.get('error')}")
 
+                elif pk_cols:
+                    uploaded_file = st.file_uploader(
+                        "Upload a data file with the primary keys of the rows to delete",
+                        type=UPLOAD_TYPES
+                    )
+                    if uploaded_file:
+                        keys = read_upload(uploaded_file)
+                        missing_cols = [col for col in pk_cols if keys is not None and col not in keys.columns]
+                        if missing_cols:
+                            st.error(f"The file has no column(s): {', '.join(missing_cols)}")
+                        elif keys is not None:
+                            st.write(f"{len(keys):,} keys in file. Preview:")
+                            st.dataframe(keys[pk_cols].head())
+
+                            method = "One request per key"
+                            if isinstance(uploader, DatasetteUploader):
+                                method = st.radio(
+                                    "Delete method",
+                                    ["One request per key", "SQL statements (datasette-write)", "Staged, one SQL statement (datasette-write)"],
+                                    help=f"SQL statements: one DELETE ... IN (...) per {DEFAULT_DELETE_CHUNK} keys, reporting totals per chunk. "
+                                         "Staged: the keys are uploaded to a temporary staging table in batches, deleted with a single "
+                                         "DELETE ... IN (SELECT ...) and the staging table is dropped; needs create-table too and "
+                                         "only reports totals. Both need the datasette-write permission."
+                                )
+                            use_sql = method.startswith("SQL")
+                            staged = method.startswith("Staged")
+
+                            if st.button("Delete Rows", type="primary"):
+                                result = run_write(
+                                    f"Deleting rows from '{table}'...",
+                                    lambda progress: uploader.bulk_delete(
+                                        database, table, keys, pk_cols,
+                                        use_sql=use_sql,
+                                        progress=progress,
+                                        staged=staged
+                                    ),
+                                    instance,
+                                )
+
+                                if result is not None:
+                                    st.caption(
+                                        f"{result['rows_deleted']:,} rows deleted for {result['rows_total']:,} unique keys in "
+                                        f"{result['elapsed']:.1f}s • {result['rows_per_sec']:,.0f} rows/s • "
+                                        f"{result['rows_missing']:,} not found • {result['duplicate_keys']:,} duplicate and "
+                                        f"{result['null_keys']:,} incomplete keys skipped"
+                                    )
+                                    if result.get('success'):
+                                        st.success("✅ Rows deleted successfully!")
+                                        show_table_preview(uploader, database, table)
+                                    else:
+                                        st.error(f"❌ {result['error']}")
+                                    status = result['status']
+                                    if not status['success'].all():
+                                        st.dataframe(status[~status['success']])
+
 
 
 
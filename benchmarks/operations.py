@@ -0,0 +1,330 @@
+"""
+Benchmark: end-to-end write operations against a local Datasette.
+
+Starts Datasette (with datasette-write and datasette-auth-tokens) on temp
+copies of Car_Database.db and eiti_database.db, then times load_file,
+iter_file_chunks, create_table, insert_rows, bulk_update (per-row and
+upsert) and bulk_delete (per-key and SQL) on synthetic frames of each
+size and width.
+Throughput, per-request latency percentiles and peak Python memory are
+written to a JSON report; --compare prints the change against an earlier
+report.
+
+    uv run python benchmarks/operations.py --rows 1000,10000 --cols 5,30
+    uv run python benchmarks/operations.py --output new.json --compare old.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import secrets
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_uploader import core  # noqa: E402
+from serialization import make_frame  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASES = ("Car_Database.db", "eiti_database.db")
+OPERATIONS = (
+    "load_file", "iter_file_chunks", "create_table", "insert_rows",
+    "update_rows", "upsert_rows", "bulk_delete", "bulk_delete_sql",
+)
+SERVER_CONFIG = """\
+plugins:
+  datasette-auth-tokens:
+    tokens:
+      - token: "{token}"
+        actor:
+          id: "benchmark"
+permissions:
+  create-table:
+    id: benchmark
+  insert-row:
+    id: benchmark
+  update-row:
+    id: benchmark
+  delete-row:
+    id: benchmark
+  drop-table:
+    id: benchmark
+  datasette-write:
+    id: benchmark
+"""
+
+
+class LocalDatasette:
+    """A throwaway Datasette serving temp copies of the repo databases"""
+
+    def __init__(self, python: str = sys.executable, max_insert_rows: int = core.DEFAULT_BATCH_ROWS):
+        self.python = python
+        self.max_insert_rows = max_insert_rows
+        self.token = secrets.token_hex(16)
+        self.directory = None
+        self.process = None
+        self.url = None
+
+    def __enter__(self) -> "LocalDatasette":
+        self.directory = tempfile.mkdtemp(prefix="datasette-bench-")
+        for name in DATABASES:
+            shutil.copy(os.path.join(ROOT, name), self.directory)
+        config = os.path.join(self.directory, "datasette.yaml")
+        with open(config, "w") as f:
+            f.write(SERVER_CONFIG.format(token=self.token))
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [self.python, "-m", "datasette", "serve", *DATABASES, "-c", config, "-p", str(port),
+             "--setting", "max_insert_rows", str(self.max_insert_rows)],
+            cwd=self.directory,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Datasette exited: {self.process.stderr.read().decode()[-2000:]}")
+            try:
+                if requests.get(f"{self.url}/-/versions.json", timeout=1).ok:
+                    return self
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError("Datasette did not start within 30 seconds")
+
+    def versions(self) -> Dict[str, Any]:
+        versions = requests.get(f"{self.url}/-/versions.json", timeout=5).json()
+        plugins = requests.get(f"{self.url}/-/plugins.json", timeout=5).json()
+        return {
+            "datasette": versions.get("datasette", {}).get("version"),
+            "sqlite": versions.get("sqlite", {}).get("version"),
+            "plugins": {p["name"]: p.get("version") for p in plugins},
+        }
+
+    def __exit__(self, *exc):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def synthetic_frame(rows: int, cols: int, start: int = 0, seed: int = 0) -> pd.DataFrame:
+    """make_frame with an integer 'id' key column first"""
+    df = make_frame(rows, max(cols - 1, 1), seed=seed)
+    df.insert(0, "id", range(start, start + rows))
+    return df
+
+
+def measure(fn: Callable[[], Any], memory: bool) -> Dict[str, Any]:
+    """Run fn once; wall time and, with memory, peak traced allocations"""
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+    if isinstance(result, dict) and result.get("success") is False:
+        raise RuntimeError(f"operation failed: {str(result.get('error', result.get('response')))[:300]}")
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def run_sequence(
+    server: LocalDatasette,
+    database: str,
+    df: pd.DataFrame,
+    csv_path: str,
+    keyed_rows: int,
+    metrics: core.UploadMetrics,
+    memory: bool,
+    suffix: str,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    One pass over every operation on a fresh table. Each operation gets
+    its own uploader and metrics window so latencies are not mixed.
+    """
+    rows, cols = df.shape
+    table = f"bench_{rows}x{cols}_{suffix}"
+    more = synthetic_frame(rows, cols, start=rows, seed=1)
+    changed = df.head(keyed_rows).copy()
+    changed[changed.columns[1]] = changed[changed.columns[1]].iloc[::-1].values
+    keys = pd.concat([df[["id"]], more[["id"]]], ignore_index=True)
+    # Per-key deletes are one request each, so only keyed_rows go that way
+    keys, rest = keys.head(keyed_rows), keys.iloc[keyed_rows:]
+
+    def uploader() -> core.DatasetteUploader:
+        metrics.reset()
+        return core.DatasetteUploader(server.url, server.token, metrics=metrics)
+
+    def parse_file():
+        with open(csv_path, "rb") as f:
+            return core.load_file(f)
+
+    def parse_chunks():
+        with open(csv_path, "rb") as f:
+            return sum(len(chunk) for chunk in core.iter_file_chunks(f))
+
+    steps = [
+        ("load_file", rows, parse_file),
+        ("iter_file_chunks", rows, parse_chunks),
+        ("create_table", rows, lambda: uploader().create_table(database, table, df, pk="id")),
+        ("insert_rows", rows, lambda: uploader().insert_rows(database, table, more)),
+        ("update_rows", len(changed), lambda: uploader().bulk_update(database, table, changed, ["id"])),
+        ("upsert_rows", len(changed), lambda: uploader().bulk_update(database, table, changed, ["id"], use_upsert=True)),
+        ("bulk_delete", len(keys), lambda: uploader().bulk_delete(database, table, keys, ["id"])),
+        ("bulk_delete_sql", len(rest), lambda: uploader().bulk_delete(database, table, rest, ["id"], use_sql=True)),
+    ]
+    results = {}
+    try:
+        for name, op_rows, fn in steps:
+            outcome = measure(fn, memory)
+            # Write requests only; metadata lookups are cached and would skew percentiles
+            events = [json.loads(line) for line in metrics.to_json_lines().splitlines()]
+            seconds = pd.Series([e["seconds"] for e in events if e["call"] != "metadata"], dtype=float)
+            outcome["rows"] = op_rows
+            outcome["requests"] = len(seconds)
+            outcome["errors"] = sum(1 for e in events if e["error"] or e["status"] >= 400)
+            outcome["latency_ms"] = {
+                q: float(seconds.quantile(p) * 1000) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+            } if len(seconds) else None
+            metrics.reset()
+            results[name] = outcome
+    finally:
+        core.DatasetteUploader(server.url, server.token).drop_table(database, table, confirm=True)
+    return results
+
+
+def aggregate(name: str, rows: int, cols: int, runs: List[Dict[str, Any]], peak: Optional[int]) -> Dict[str, Any]:
+    seconds = [run["seconds"] for run in runs]
+    median = statistics.median(seconds)
+    op_rows = runs[0]["rows"]
+    latency = [run["latency_ms"] for run in runs if run["latency_ms"]]
+    return {
+        "operation": name,
+        "rows": rows,
+        "cols": cols,
+        "op_rows": op_rows,
+        "repeat": len(runs),
+        "seconds_median": median,
+        "seconds_best": min(seconds),
+        "rows_per_sec": op_rows / median if median else None,
+        "requests": runs[0]["requests"],
+        "errors": sum(run["errors"] for run in runs),
+        "latency_ms": {
+            q: statistics.median(values[q] for values in latency) for q in ("p50", "p95", "p99")
+        } if latency else None,
+        "peak_mb": peak / 1e6 if peak is not None else None,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: Dict[str, Any], baseline_path: str):
+    """Print the throughput and peak memory change for every case in both reports"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["operation"], r["rows"], r["cols"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('commit')})")
+    for result in report["results"]:
+        old = before.get((result["operation"], result["rows"], result["cols"]))
+        if not old or not old.get("rows_per_sec") or not result.get("rows_per_sec"):
+            continue
+        speedup = result["rows_per_sec"] / old["rows_per_sec"]
+        memory = ""
+        if old.get("peak_mb") and result.get("peak_mb"):
+            memory = f"  memory {result['peak_mb'] / old['peak_mb']:5.2f}x"
+        print(f"{result['operation']:18} {result['rows']:>9,} x {result['cols']:<3} throughput {speedup:5.2f}x{memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", default="1000,10000", help="comma-separated frame sizes")
+    parser.add_argument("--cols", default="5,30", help="comma-separated frame widths")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keyed-rows", type=int, default=1000, help="rows sent one request each by update_rows/bulk_delete")
+    parser.add_argument("--database", default="Car_Database", choices=[name[:-3] for name in DATABASES])
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra pass that traces peak memory")
+    parser.add_argument("--python", default=sys.executable, help="interpreter with datasette installed")
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    sizes = [int(v) for v in args.rows.split(",")]
+    widths = [int(v) for v in args.cols.split(",")]
+    metrics = core.UploadMetrics()
+    results = []
+    with LocalDatasette(args.python) as server, tempfile.TemporaryDirectory() as scratch:
+        meta = {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "orjson": core.orjson is not None,
+            "batch_rows": core.DEFAULT_BATCH_ROWS,
+            "max_in_flight": core.DEFAULT_MAX_IN_FLIGHT,
+            "server": server.versions(),
+        }
+        for rows in sizes:
+            for cols in widths:
+                df = synthetic_frame(rows, cols)
+                csv_path = os.path.join(scratch, f"{rows}x{cols}.csv")
+                df.to_csv(csv_path, index=False)
+                keyed_rows = min(args.keyed_rows, rows)
+                runs = [
+                    run_sequence(server, args.database, df, csv_path, keyed_rows, metrics, False, str(i))
+                    for i in range(args.repeat)
+                ]
+                peaks = {}
+                if not args.no_memory:
+                    traced = run_sequence(server, args.database, df, csv_path, keyed_rows, metrics, True, "mem")
+                    peaks = {name: outcome["peak_bytes"] for name, outcome in traced.items()}
+                for name in OPERATIONS:
+                    result = aggregate(name, rows, cols, [run[name] for run in runs], peaks.get(name))
+                    results.append(result)
+                    latency = result["latency_ms"]
+                    print(
+                        f"{name:18} {rows:>9,} x {cols:<3} {result['seconds_median']:8.3f}s "
+                        f"{result['rows_per_sec']:>12,.0f} rows/s"
+                        + (f"  p50 {latency['p50']:7.1f}ms p99 {latency['p99']:7.1f}ms" if latency else "")
+                        + (f"  peak {result['peak_mb']:7.1f} MB" if result["peak_mb"] is not None else "")
+                    )
+
+    report = {"meta": meta, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
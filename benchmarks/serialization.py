@@ -0,0 +1,83 @@
+"""
+Micro-benchmark: write API body serialization.
+
+Compares the previous path (df.to_dict('records') + stdlib json.dumps) with
+encode_json_body, with and without orjson, on a mixed-type frame.
+
+    uv run python benchmarks/serialization.py --rows 100000 --cols 30
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_uploader import core  # noqa: E402
+
+
+def make_frame(rows: int, cols: int, seed: int = 0) -> pd.DataFrame:
+    """Mixed ints, floats with ~10% NaN, strings with gaps, timestamps and bools"""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        kind = i % 5
+        if kind == 0:
+            data[f"int_{i}"] = rng.integers(0, 1_000_000, rows)
+        elif kind == 1:
+            values = rng.random(rows)
+            values[rng.random(rows) < 0.1] = np.nan
+            data[f"float_{i}"] = values
+        elif kind == 2:
+            data[f"text_{i}"] = rng.choice(["alpha", "beta", "gamma", None], rows)
+        elif kind == 3:
+            data[f"when_{i}"] = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 10**8, rows), unit="s")
+        else:
+            data[f"flag_{i}"] = rng.random(rows) < 0.5
+    return pd.DataFrame(data)
+
+
+def previous_path(df: pd.DataFrame) -> bytes:
+    # default=str is needed for Timestamps; NaN is emitted as invalid JSON
+    return json.dumps({"rows": df.to_dict('records')}, default=str).encode('utf-8')
+
+
+def timed(fn, df: pd.DataFrame, repeat: int):
+    best, size = float('inf'), 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = len(fn(df))
+        best = min(best, time.perf_counter() - started)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--cols", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows, args.cols)
+    cases = [("to_dict + json.dumps", previous_path)]
+    fast_backend = core.orjson
+    core.orjson = None
+    cases.append(("encode_json_body (stdlib json)", core.encode_json_body))
+    results = [(name, *timed(fn, df, args.repeat)) for name, fn in cases]
+    if fast_backend is not None:
+        core.orjson = fast_backend
+        results.append(("encode_json_body (orjson)", *timed(core.encode_json_body, df, args.repeat)))
+    else:
+        print("orjson is not installed; skipping the fast backend")
+
+    baseline = results[0][1]
+    print(f"{args.rows:,} rows x {args.cols} columns, best of {args.repeat}")
+    for name, seconds, size in results:
+        print(f"{name:34} {seconds:7.3f}s  {size / 1e6:7.1f} MB  {baseline / seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+"""
+Bulk uploads to Datasette: the upload logic (data_uploader.core) and the
+data-uploader command line (data_uploader.cli). The Streamlit app is
+app.py at the top of the repository.
+"""
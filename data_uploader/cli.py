@@ -0,0 +1,254 @@
+"""
+Command line uploader: the app's create/insert/update/delete operations
+without Streamlit, for cron jobs and pipelines.
+
+    data-uploader insert --url https://example.datasette.io --db mydb --table cars cars.csv
+    data-uploader create --db mydb --pk id 'exports/*.csv' --jobs 4 --progress json
+    some-export | data-uploader insert --db mydb --table cars -
+
+The instance and token default to $DATASETTE_URL and $DATASETTE_TOKEN.
+With several files each gets its own table (named after the file) unless
+--table is given. Progress goes to stderr and one result per file to
+stdout; with --progress json both are JSON lines. The exit status is 1
+if any file failed.
+
+pandas and the upload code are only imported once the arguments have
+been parsed, so --help and usage errors return immediately.
+"""
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+STDIN = '-'
+# Failed rows/keys listed per file in the result, beyond which only counts are kept
+MAX_REPORTED_FAILURES = 100
+# Seconds between text progress lines for one file
+TEXT_PROGRESS_INTERVAL = 1.0
+
+
+class ProgressPrinter:
+    """
+    Thread-safe progress and result output. 'json' writes one object per
+    line (progress events to stderr, results to stdout); 'text' writes
+    throttled human-readable lines; 'none' writes results only.
+    """
+    def __init__(self, mode: str):
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._last: Dict[str, float] = {}
+
+    def _emit(self, stream, text: str):
+        with self._lock:
+            stream.write(text + '\n')
+            stream.flush()
+
+    def callback(self, source: str) -> Callable[[int, Optional[int], Dict[str, Any]], None]:
+        def update(done: int, total: Optional[int], batch: Dict[str, Any]):
+            if self.mode == 'json':
+                self._emit(sys.stderr, json.dumps({
+                    'event': 'progress', 'file': source, 'rows_done': done, 'rows_total': total,
+                    'batch_start': batch.get('start'), 'batch_end': batch.get('end'),
+                    'batch_success': bool(batch.get('success')),
+                }))
+            elif self.mode == 'text':
+                now = time.monotonic()
+                if now - self._last.get(source, 0.0) >= TEXT_PROGRESS_INTERVAL or done == total:
+                    self._last[source] = now
+                    of_total = f"/{total:,}" if total else ""
+                    self._emit(sys.stderr, f"{source}: {done:,}{of_total} rows")
+        return update
+
+    def result(self, source: str, table: str, result: Dict[str, Any]):
+        if self.mode == 'json':
+            self._emit(sys.stdout, json.dumps({'event': 'result', 'file': source, 'table': table, **result}, default=str))
+            return
+        if result.get('success'):
+            rows = result.get('rows_written', result.get('rows_updated', result.get('rows_deleted')))
+            rate = f" ({result['rows_per_sec']:,.0f} rows/s)" if result.get('rows_per_sec') else ""
+            self._emit(sys.stdout, f"{source} -> {table}: ok, {rows if rows is not None else '?'} rows{rate}")
+        else:
+            self._emit(sys.stdout, f"{source} -> {table}: FAILED: {result.get('error', result.get('response'))}")
+
+
+def expand_sources(patterns: List[str]) -> List[str]:
+    """Paths in order, with globs expanded (for shells that pass them quoted) and '-' kept for stdin"""
+    sources = []
+    for pattern in patterns:
+        if pattern == STDIN or not glob.has_magic(pattern):
+            sources.append(pattern)
+            continue
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            raise SystemExit(f"data-uploader: no files match {pattern!r}")
+        sources.extend(matches)
+    if sources.count(STDIN) > 1:
+        raise SystemExit("data-uploader: stdin ('-') can only be read once")
+    return sources
+
+
+def open_source(source: str, file_format: Optional[str]):
+    """A readable binary file for source; stdin is streamed unless it is a workbook"""
+    if source != STDIN:
+        return open(source, 'rb')
+    if file_format == 'excel':
+        # openpyxl needs to seek, so a workbook on stdin is read into memory
+        buffer = io.BytesIO(sys.stdin.buffer.read())
+        buffer.name = '<stdin>.xlsx'
+        return buffer
+    return sys.stdin.buffer
+
+
+def jsonable(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop DataFrames from a result dict, keeping at most MAX_REPORTED_FAILURES failed rows from 'status'"""
+    import pandas as pd
+
+    out = {}
+    for key, value in result.items():
+        if isinstance(value, pd.DataFrame):
+            if key == 'status' and 'success' in value:
+                failed = value[~value['success'].astype(bool)]
+                out['failures'] = json.loads(failed.head(MAX_REPORTED_FAILURES).to_json(orient='records'))
+            continue
+        out[key] = value
+    return out
+
+
+def table_name(args, source: str) -> str:
+    """--table, or the file name without its extension"""
+    return args.table or os.path.splitext(os.path.basename(source))[0]
+
+
+def make_uploader(args):
+    from data_uploader import core
+
+    if args.local:
+        return core.LocalSQLiteUploader(args.local)
+    if not args.url:
+        raise SystemExit("data-uploader: give --url, set DATASETTE_URL or use --local DIR")
+    return core.DatasetteUploader(
+        args.url,
+        args.token,
+        batch_rows=args.batch_rows or core.DEFAULT_BATCH_ROWS,
+        batch_bytes=args.batch_bytes or core.DEFAULT_BATCH_BYTES,
+        max_in_flight=args.concurrency or core.DEFAULT_MAX_IN_FLIGHT,
+        compression=args.compression,
+    )
+
+
+def upload_one(args, uploader, source: str, printer: ProgressPrinter) -> bool:
+    """Run the command for one file; returns whether it succeeded"""
+    from data_uploader import core
+    import pandas as pd
+
+    table = table_name(args, source)
+    kind = args.format or core.file_kind(source) or ('csv' if source == STDIN else None)
+    progress = printer.callback(source)
+    chunk_rows = args.chunk_rows or core.DEFAULT_CHUNK_ROWS
+    try:
+        with open_source(source, args.format) as f:
+            if args.command == 'create':
+                chunks = core.iter_file_chunks(f, chunk_rows, args.engine, kind=kind, columns=args.columns)
+                result = uploader.create_table(args.db, table, chunks, progress=progress, pk=args.pk or None)
+            elif args.command == 'insert':
+                column_types = uploader.get_column_types(args.db, table)
+                chunks = core.iter_file_chunks(f, chunk_rows, args.engine, column_types, kind=kind, columns=args.columns)
+                result = uploader.insert_rows(args.db, table, chunks, progress=progress, replace=args.replace)
+            else:
+                # Updates and deletes need every key up front
+                columns = args.pk if args.command == 'delete' else args.columns
+                if columns:
+                    columns = list(dict.fromkeys(args.pk + columns))
+                df = pd.concat(core.iter_file_chunks(f, chunk_rows, args.engine, kind=kind, columns=columns), ignore_index=True)
+                missing = [pk for pk in args.pk if pk not in df.columns]
+                if missing:
+                    raise ValueError(f"Key column(s) not in file: {', '.join(missing)}")
+                if args.command == 'update':
+                    result = uploader.bulk_update(args.db, table, df, args.pk, use_upsert=args.upsert, progress=progress, staged=args.staged)
+                else:
+                    result = uploader.bulk_delete(args.db, table, df[args.pk], args.pk, use_sql=args.sql, progress=progress, staged=args.staged)
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    printer.result(source, table, jsonable(result))
+    return bool(result.get('success'))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    target = common.add_argument_group("target")
+    target.add_argument("--url", default=os.environ.get("DATASETTE_URL"), help="Datasette instance (default: $DATASETTE_URL)")
+    target.add_argument("--token", default=os.environ.get("DATASETTE_TOKEN"), help="API token (default: $DATASETTE_TOKEN)")
+    target.add_argument("--local", metavar="DIR", help="write to the SQLite files in DIR instead of an instance")
+    target.add_argument("--db", required=True, help="database name")
+    target.add_argument("--table", help="table name (default: the file name without extension)")
+    tuning = common.add_argument_group("tuning")
+    # Defaults of None fall back to the app's defaults in data_uploader.core, which is not imported yet
+    tuning.add_argument("--batch-rows", type=int, help="rows per write request (default: 100)")
+    tuning.add_argument("--batch-bytes", type=int, help="bytes per write request (default: 2 MiB)")
+    tuning.add_argument("--concurrency", type=int, help="write requests in flight per file (default: 4)")
+    tuning.add_argument("--jobs", type=int, default=1, help="files uploaded at once (default: %(default)s)")
+    tuning.add_argument("--chunk-rows", type=int, help="rows parsed at a time (default: 50000)")
+    tuning.add_argument("--engine", choices=["pandas", "pyarrow"], default="pandas", help="CSV parser")
+    tuning.add_argument("--compression", choices=["gzip", "zstd"], help="Content-Encoding for request bodies")
+    io_group = common.add_argument_group("input/output")
+    io_group.add_argument(
+        "--format", choices=["csv", "excel", "parquet", "arrow", "jsonl"],
+        help="input format when it cannot be told from the name (stdin)",
+    )
+    io_group.add_argument(
+        "--columns", type=lambda value: value.split(","),
+        help="comma-separated columns to upload; the rest are never read (delete reads only --pk)",
+    )
+    io_group.add_argument("--progress", choices=["text", "json", "none"], default="text", help="progress output on stderr")
+
+    parser = argparse.ArgumentParser(prog="data-uploader", description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", parents=[common], help="create a table from each file")
+    create.add_argument("--pk", action="append", help="primary key column (repeat for a compound key)")
+    insert = commands.add_parser("insert", parents=[common], help="append each file's rows to a table")
+    insert.add_argument("--replace", action="store_true", help="replace rows whose primary key already exists")
+    update = commands.add_parser("update", parents=[common], help="update rows by primary key")
+    update.add_argument("--pk", action="append", required=True, help="primary key column (repeat for a compound key)")
+    update_method = update.add_mutually_exclusive_group()
+    update_method.add_argument("--upsert", action="store_true", help="send /-/upsert batches (inserts missing keys)")
+    delete = commands.add_parser("delete", parents=[common], help="delete the rows whose keys are listed in each file")
+    delete.add_argument("--pk", action="append", required=True, help="primary key column (repeat for a compound key)")
+    delete_method = delete.add_mutually_exclusive_group()
+    delete_method.add_argument("--sql", action="store_true", help="delete with DELETE ... IN (...) statements (needs datasette-write)")
+    for method in (update_method, delete_method):
+        method.add_argument(
+            "--staged", action="store_true",
+            help="upload to a staging table and apply with one SQL statement (needs datasette-write)",
+        )
+    for command in (create, insert, update, delete):
+        command.add_argument("files", nargs="+", help="files or glob patterns; '-' reads stdin")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    sources = expand_sources(args.files)
+    if STDIN in sources and not args.table:
+        raise SystemExit("data-uploader: --table is required when reading stdin")
+    if args.command == 'create':
+        tables = [table_name(args, source) for source in sources]
+        if len(set(tables)) < len(tables):
+            raise SystemExit("data-uploader: create makes one table per file, but several files map to the same table")
+    logging.basicConfig(level=logging.WARNING, format="data-uploader: %(message)s")
+
+    uploader = make_uploader(args)
+    printer = ProgressPrinter(args.progress)
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        outcomes = list(pool.map(lambda source: upload_one(args, uploader, source, printer), sources))
+    return 0 if all(outcomes) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
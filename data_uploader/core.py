@@ -0,0 +1,3422 @@
+"""
+Upload logic shared by the Streamlit app (app.py) and the command line
+(data_uploader.cli): HTTP sessions, body serialization, the Datasette and local
+SQLite uploaders, jobs, checkpoints, sync, validation and file reading.
+
+Nothing here imports Streamlit. Errors that the UI used to show inline
+(failed listings, unreadable files) are logged to this module's logger;
+app.py shows them with st.error and the CLI prints them to stderr.
+"""
+import pandas as pd
+import requests
+import httpx
+import asyncio
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util import make_headers
+import json
+import logging
+import sqlite3
+import os
+import tempfile
+from contextlib import closing
+from typing import Dict, List, Any, Optional, Callable, Iterable, Iterator, Tuple, Union
+import urllib.parse
+import time
+import threading
+import uuid
+import hashlib
+import base64
+import zlib
+import gzip
+import bisect
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bulk write tuning. Datasette rejects /-/insert bodies with more than
+# max_insert_rows rows (100 by default), so batches default to that size.
+DEFAULT_BATCH_ROWS = 100
+DEFAULT_BATCH_BYTES = 2 * 1024 * 1024
+DEFAULT_MAX_IN_FLIGHT = 4
+
+# progress(rows_done, rows_total, batch) - called from the calling thread;
+# rows_total is None when rows are streamed from a file of unknown length
+ProgressCallback = Callable[[int, Optional[int], Dict[str, Any]], None]
+
+# Connection pool and retry policy for the shared HTTP session
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = (10, 120)  # (connect, read) seconds
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  # seconds, doubled on every retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Write API calls are POSTs and are not idempotent: a request that timed out
+# or got a 5xx may still have been applied, and replaying an insert would
+# duplicate rows. They are only resent when the server refused them unread.
+WRITE_RETRY_STATUSES = (429, 503)
+
+class WriteSafeRetry(Retry):
+    """
+    Retry that resends idempotent requests on RETRY_STATUSES and read errors,
+    but other methods (POST) only on connection errors and
+    WRITE_RETRY_STATUSES. Read errors are never retried for POST because
+    POST is not in allowed_methods.
+    """
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if not self._is_method_retryable(method):
+            return status_code in WRITE_RETRY_STATUSES
+        return super().is_retry(method, status_code, has_retry_after)
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to requests that don't set one"""
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+def make_session(
+    token: Optional[str] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    timeout=DEFAULT_TIMEOUT,
+) -> requests.Session:
+    """
+    Build a keep-alive requests.Session with a connection pool of pool_size
+    and exponential backoff on failed connections, and for reads also on
+    5xx responses and timeouts. Writes are only resent after 429/503 (see
+    WriteSafeRetry). Retry-After headers sent with 429/503 are honoured.
+    """
+    retry = WriteSafeRetry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+        timeout=timeout,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # Offer every response encoding urllib3 can decode here (br and zstd
+    # when their packages are installed), so table pages read through a
+    # compressing proxy come back in the smallest form
+    session.headers['Accept-Encoding'] = make_headers(accept_encoding=True)['accept-encoding']
+    if token:
+        session.headers['Authorization'] = f'Bearer {token}'
+    return session
+
+
+# Table reads follow Datasette's keyset pagination; 1000 is its default max_returned_rows
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_PREVIEW_ROWS = 100
+
+# Uploaded files are parsed and sent this many rows at a time
+DEFAULT_CHUNK_ROWS = 50_000
+
+# How long database/table/schema listings are served from cache
+DEFAULT_METADATA_TTL = 60  # seconds
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON backend
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # optional zstd request compression
+    zstandard = None
+
+# Rows are serialized this many at a time when building a JSON body
+JSON_ROWS_PER_PIECE = 1000
+
+def _json_default(value: Any) -> Any:
+    """JSON fallback for pandas/numpy values that survive column conversion"""
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, pd.Timedelta)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def dumps_json(value: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _column_values(series: pd.Series) -> List[Any]:
+    """
+    Convert a column to JSON-ready Python values in one vectorized pass:
+    NaN/NA/NaT become None, datetimes become ISO 8601 strings and numpy
+    scalars become native ints/floats/bools.
+    """
+    dtype = series.dtype
+    if dtype.kind == 'M':
+        # Second precision unless the column actually carries fractions
+        present = series.dropna()
+        whole_seconds = bool(((present.dt.microsecond == 0) & (present.dt.nanosecond == 0)).all())
+        unit = 's' if whole_seconds else 'us'
+        if getattr(dtype, 'tz', None) is not None:
+            values = np.datetime_as_string(series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(), unit=unit) + 'Z'
+        else:
+            values = np.datetime_as_string(series.to_numpy(), unit=unit)
+        values = values.astype(object)
+        values[series.isna().to_numpy()] = None
+        return values.tolist()
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iub':
+        return series.to_numpy().tolist()
+    if isinstance(dtype, np.dtype) and dtype.kind == 'f':
+        raw = series.to_numpy()
+        values = raw.astype(object)
+        values[np.isnan(raw)] = None
+        return values.tolist()
+    return series.to_numpy(dtype=object, na_value=None).tolist()
+
+def iter_records(df: pd.DataFrame) -> Iterator[Dict[str, Any]]:
+    """Yield JSON-ready row dicts without going through df.to_dict('records')"""
+    names = [str(col) for col in df.columns]
+    columns = [_column_values(df.iloc[:, i]) for i in range(df.shape[1])]
+    for row in zip(*columns):
+        yield dict(zip(names, row))
+
+def iter_json_body(
+    df: pd.DataFrame,
+    extra: Optional[Dict[str, Any]] = None,
+    rows_per_piece: int = JSON_ROWS_PER_PIECE,
+) -> Iterator[bytes]:
+    """
+    Yield a write API body {**extra, "rows": [...]} as byte pieces.
+    Only rows_per_piece row dicts exist at a time, so the body can be
+    joined into one buffer or sent as a chunked upload.
+    """
+    head = dumps_json({**(extra or {}), "rows": []})
+    yield head[:-2]  # everything up to and including '['
+    records = iter_records(df)
+    first = True
+    while True:
+        piece = [record for _, record in zip(range(rows_per_piece), records)]
+        if not piece:
+            break
+        encoded = dumps_json(piece)[1:-1]
+        yield encoded if first else b',' + encoded
+        first = False
+    yield b']}'
+
+def encode_json_body(df: pd.DataFrame, extra: Optional[Dict[str, Any]] = None) -> bytes:
+    return b''.join(iter_json_body(df, extra))
+
+# Request body encodings; zstd needs the zstandard package
+COMPRESSION_METHODS = ['gzip', 'zstd'] if zstandard else ['gzip']
+COMPRESSION_REFUSED = "Could not confirm that the server decodes compressed request bodies, so this upload was sent uncompressed"
+# What each write endpoint answers to an empty JSON object, which it only
+# says after passing the permission checks and reading the body
+COMPRESSION_PROBE_ERRORS = {
+    'create': 'Table is required',
+    'insert': 'JSON must have one or other of "row" or "rows"',
+    'upsert': 'JSON must have one or other of "row" or "rows"',
+}
+
+def probe_decoded(status_code: int, payload: Any, endpoint: str) -> bool:
+    """Whether a compressed empty-body probe of endpoint got the error that shows the body was decoded"""
+    return status_code == 400 and isinstance(payload, dict) and COMPRESSION_PROBE_ERRORS[endpoint] in (payload.get('errors') or [])
+
+def compress_body(body: bytes, method: Optional[str]) -> bytes:
+    """Encode a request body for the given Content-Encoding (None leaves it as is)"""
+    if method == 'gzip':
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    if method == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+def iter_wire_batches(
+    df: pd.DataFrame,
+    batch_rows: int,
+    batch_bytes: int,
+    extra: Optional[Dict[str, Any]] = None,
+    compression: Optional[str] = None,
+) -> Iterator[Tuple[int, int, bytes, bytes]]:
+    """
+    Yield (start, end, wire, raw) for consecutive row ranges of df.
+    Batches hold at most batch_rows rows; a batch whose body as sent is
+    larger than batch_bytes is halved until it fits (or is a single row).
+    With compression, batch_bytes is a budget for the compressed body, so
+    well-compressing rows go out in fewer, fuller requests. Without
+    compression wire is raw.
+    """
+    def split(start: int, end: int) -> Iterator[Tuple[int, int, bytes, bytes]]:
+        raw = encode_json_body(df.iloc[start:end], extra)
+        wire = compress_body(raw, compression)
+        if len(wire) > batch_bytes and end - start > 1:
+            mid = start + (end - start) // 2
+            yield from split(start, mid)
+            yield from split(mid, end)
+        else:
+            yield start, end, wire, raw
+
+    for start in range(0, len(df), batch_rows):
+        yield from split(start, min(start + batch_rows, len(df)))
+
+def pk_options(pk: Optional[Union[str, List[str]]]) -> Dict[str, Any]:
+    """The /-/create body keys for a single or compound primary key"""
+    if not pk:
+        return {}
+    if isinstance(pk, str):
+        return {"pk": pk}
+    return {"pk": pk[0]} if len(pk) == 1 else {"pks": list(pk)}
+
+def delete_pk_path(row_pks: Any) -> str:
+    """Tilde-encode PKs (Datasette requirement: ~ becomes ~~ , / becomes ~s , etc.)"""
+    def tilde_encode(value: str) -> str:
+        return (
+            str(value)
+            .replace("~", "~~")
+            .replace("/", "~s")
+            .replace(",", "~c")
+            .replace("?", "~q")
+            .replace("#", "~h")
+        )
+
+    if isinstance(row_pks, (list, tuple)):
+        return ",".join([tilde_encode(str(pk)) for pk in row_pks])
+    return tilde_encode(str(row_pks))
+
+# Keys per DELETE statement; also capped so one statement stays under
+# SQLite's conservative 999 bound parameter limit
+DEFAULT_DELETE_CHUNK = 500
+SQLITE_MAX_PARAMS = 999
+
+def dedupe_keys(keys: pd.DataFrame, pk_cols: List[str]) -> Tuple[pd.DataFrame, int, int]:
+    """
+    Reduce a key file to unique, complete primary key tuples.
+    Returns (unique keys, rows with a missing key value, duplicate rows).
+    """
+    keys = keys[pk_cols]
+    complete = keys.notna().all(axis=1)
+    duplicated = keys.duplicated() & complete
+    unique = keys[complete & ~duplicated].reset_index(drop=True)
+    # A blank cell turns an integer column into floats; keys must not read "1.0"
+    for col in pk_cols:
+        if pd.api.types.is_float_dtype(unique[col]) and (unique[col] % 1 == 0).all():
+            unique[col] = unique[col].astype('int64')
+    return unique, int((~complete).sum()), int(duplicated.sum())
+
+def delete_keys_sql(table: str, pk_cols: List[str], count: int) -> str:
+    """DELETE statement for count keys with named parameters :p0, :p1, ..."""
+    names = iter(f":p{i}" for i in range(count * len(pk_cols)))
+    if len(pk_cols) == 1:
+        values = ", ".join(next(names) for _ in range(count))
+        return f"DELETE FROM {quote_identifier(table)} WHERE {quote_identifier(pk_cols[0])} IN ({values})"
+    rows = ", ".join("(" + ", ".join(next(names) for _ in pk_cols) + ")" for _ in range(count))
+    columns = ", ".join(quote_identifier(col) for col in pk_cols)
+    return f"DELETE FROM {quote_identifier(table)} WHERE ({columns}) IN (VALUES {rows})"
+
+def staged_update_sql(table: str, staging: str, pk_cols: List[str], value_cols: List[str]) -> str:
+    """UPDATE ... FROM statement copying value_cols from the staging table onto rows with the same key"""
+    assignments = ", ".join(f"{quote_identifier(col)} = s.{quote_identifier(col)}" for col in value_cols)
+    join = " AND ".join(f"{quote_identifier(table)}.{quote_identifier(pk)} = s.{quote_identifier(pk)}" for pk in pk_cols)
+    return f"UPDATE {quote_identifier(table)} SET {assignments} FROM {quote_identifier(staging)} AS s WHERE {join}"
+
+def staged_delete_sql(table: str, staging: str, pk_cols: List[str]) -> str:
+    """DELETE statement for every key in the staging table"""
+    columns = ", ".join(quote_identifier(col) for col in pk_cols)
+    target = columns if len(pk_cols) == 1 else f"({columns})"
+    return f"DELETE FROM {quote_identifier(table)} WHERE {target} IN (SELECT {columns} FROM {quote_identifier(staging)})"
+
+def parse_write_messages(response: requests.Response) -> List[Tuple[str, int]]:
+    """
+    Decode the (message, type) pairs datasette-write leaves in the signed
+    ds_messages cookie; type 1 is info and 3 is an error. The signature is
+    not checked, the cookie is only read for display.
+    """
+    value = response.cookies.get('ds_messages')
+    if not value:
+        return []
+    compressed = value.startswith('.')
+    payload = value.lstrip('.').split('.')[0]
+    data = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+    if compressed:
+        data = zlib.decompress(data)
+    return [tuple(message) for message in json.loads(data)]
+
+# Error for a key whose row does not exist, as Datasette words it; such
+# keys count as missing rather than failed
+RECORD_NOT_FOUND = "Record not found"
+
+# Error for an update whose file holds nothing but the key columns
+NO_VALUE_COLUMNS = "The file has no columns to update besides the key"
+
+def summarize_deletes(
+    keys: pd.DataFrame,
+    success: np.ndarray,
+    status_codes: np.ndarray,
+    errors: np.ndarray,
+    deleted: int,
+    missing: int,
+    null_keys: int,
+    duplicates: int,
+    started: float,
+) -> Dict[str, Any]:
+    """
+    Result dict for a bulk delete. Keys whose row did not exist (error
+    RECORD_NOT_FOUND) count as missing rather than failed; 'status' has one
+    row per unique key.
+    """
+    total = len(keys)
+    failed = int(total - success.sum()) - int((~success & (errors == RECORD_NOT_FOUND)).sum())
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    result = {
+        'success': failed == 0,
+        'rows_total': total,
+        'rows_deleted': deleted,
+        'rows_missing': missing,
+        'rows_failed': failed,
+        'null_keys': null_keys,
+        'duplicate_keys': duplicates,
+        'elapsed': elapsed,
+        'rows_per_sec': deleted / elapsed,
+        'status': keys.assign(success=success, status_code=status_codes, error=errors),
+    }
+    if failed:
+        result['error'] = f"{failed} of {total} keys failed to delete"
+    return result
+
+def missing_table_deletes(keys: pd.DataFrame, database: str, table: str, null_keys: int, duplicates: int, started: float) -> Dict[str, Any]:
+    """bulk_delete result when the table itself does not exist: every key failed"""
+    error = f"Table '{table}' not found in '{database}'"
+    total = len(keys)
+    result = summarize_deletes(
+        keys, np.zeros(total, dtype=bool), np.full(total, 404, dtype=np.int64), np.full(total, error, dtype=object),
+        0, 0, null_keys, duplicates, started,
+    )
+    result.update(success=False, error=error)
+    return result
+
+class MetadataCache:
+    """
+    Thread-safe TTL cache for Datasette metadata responses.
+
+    Entries are keyed by (base_url, token, path) so instances and tokens
+    with different visibility never share results. Expired entries that
+    carried an ETag are revalidated with If-None-Match instead of being
+    refetched in full.
+    """
+    def __init__(self, ttl: float = DEFAULT_METADATA_TTL):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, Optional[str], str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.invalidations = 0
+
+    def lookup(self, key: Tuple[str, Optional[str], str]) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Return (fresh, entry); a stale entry is returned so its ETag can be reused"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires'] > time.monotonic():
+                self.hits += 1
+                return True, entry
+            self.misses += 1
+            return False, entry
+
+    def store(self, key: Tuple[str, Optional[str], str], data: Any, etag: Optional[str] = None):
+        now = time.monotonic()
+        with self._lock:
+            # Drop anything that has expired without an ETag to revalidate against
+            for stale in [k for k, e in self._entries.items() if e['expires'] <= now and not e['etag']]:
+                del self._entries[stale]
+            self._entries[key] = {'data': data, 'etag': etag, 'expires': now + self.ttl}
+
+    def refresh(self, key: Tuple[str, Optional[str], str]):
+        """Extend an entry's lifetime after a 304 Not Modified"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                entry['expires'] = time.monotonic() + self.ttl
+                self.revalidated += 1
+
+    def invalidate(self, base_url: str, database: Optional[str] = None):
+        """Forget cached metadata for an instance, or just for one of its databases"""
+        with self._lock:
+            for key in list(self._entries):
+                url, _, path = key
+                if url != base_url:
+                    continue
+                if database is None or path == '/.json' or path.startswith((f"/{database}.json", f"/{database}/")):
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+                'invalidations': self.invalidations,
+            }
+
+
+# Recent calls kept for percentiles and JSON lines export
+DEFAULT_METRICS_EVENTS = 10_000
+# Upper bounds (seconds) of the exported latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# serialize + ttfb + download is the whole call
+METRICS_PHASES = ('serialize', 'ttfb', 'download')
+
+def server_timing(header: Optional[str]) -> Optional[float]:
+    """Total of the dur= entries of a Server-Timing header, in seconds"""
+    if not header:
+        return None
+    total = 0.0
+    for metric in header.split(','):
+        for param in metric.split(';')[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'dur':
+                try:
+                    total += float(value) / 1000
+                except ValueError:
+                    pass
+    return total
+
+class UploadMetrics:
+    """
+    Thread-safe recorder of Datasette API calls.
+
+    Each call records latency, bytes each way, rows, retries and status,
+    with time split into phases: serialize (encoding the body), ttfb (time
+    to first byte: uploading the body, the round trip and the server's
+    work, until the response headers arrive) and download (reading the
+    response body). Datasette does not report its own processing time, so
+    server is only set, as a part of ttfb, when a proxy sends a
+    Server-Timing header. Totals per call name are kept for Prometheus
+    export and the most recent calls for percentiles and JSON lines.
+    """
+    def __init__(self, max_events: int = DEFAULT_METRICS_EVENTS):
+        self._lock = threading.Lock()
+        self._events: deque = deque(maxlen=max_events)
+        self._totals: Dict[str, Dict[str, Any]] = {}
+        self.started = time.time()
+
+    def record(
+        self,
+        call: str,
+        seconds: float,
+        status: int = 0,
+        serialize: float = 0.0,
+        ttfb: Optional[float] = None,
+        server: Optional[float] = None,
+        bytes_sent: int = 0,
+        bytes_received: int = 0,
+        rows: int = 0,
+        retries: int = 0,
+        error: Optional[str] = None,
+    ):
+        ttfb = min(ttfb if ttfb is not None else seconds, seconds)
+        event = {
+            'time': time.time(),
+            'call': call,
+            'status': status,
+            'seconds': seconds + serialize,
+            'serialize': serialize,
+            'ttfb': ttfb,
+            'download': seconds - ttfb,
+            'server': None if server is None else min(server, ttfb),
+            'bytes_sent': bytes_sent,
+            'bytes_received': bytes_received,
+            'rows': rows,
+            'retries': retries,
+            'error': error,
+        }
+        with self._lock:
+            self._events.append(event)
+            totals = self._totals.setdefault(call, {
+                'count': 0, 'errors': 0, 'seconds': 0.0, 'bytes_sent': 0, 'bytes_received': 0,
+                'rows': 0, 'retries': 0, 'status': {}, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                'server': 0.0, 'server_timed': 0,
+                **{phase: 0.0 for phase in METRICS_PHASES},
+            })
+            totals['count'] += 1
+            totals['errors'] += int(bool(error) or status >= 400)
+            for key in ('seconds', 'bytes_sent', 'bytes_received', 'rows', 'retries', *METRICS_PHASES):
+                totals[key] += event[key]
+            if event['server'] is not None:
+                totals['server'] += event['server']
+                totals['server_timed'] += 1
+            totals['status'][status] = totals['status'].get(status, 0) + 1
+            totals['buckets'][bisect.bisect_left(LATENCY_BUCKETS, event['seconds'])] += 1
+
+    def record_response(
+        self,
+        call: str,
+        response: requests.Response,
+        seconds: float,
+        serialize: float = 0.0,
+        rows: int = 0,
+    ):
+        """Record a completed requests call, reading sizes and retries off the response"""
+        raw = response.raw
+        retries = getattr(raw, 'retries', None)
+        body = response.request.body
+        # Bytes off the wire, before any Content-Encoding is undone; urllib3
+        # does not count chunked bodies, so fall back to the decoded size
+        received = (raw.tell() if hasattr(raw, 'tell') else 0) or len(response.content)
+        self.record(
+            call,
+            seconds,
+            status=response.status_code,
+            serialize=serialize,
+            ttfb=response.elapsed.total_seconds(),
+            server=server_timing(response.headers.get('Server-Timing')),
+            bytes_sent=len(body) if body else 0,
+            bytes_received=received,
+            rows=rows,
+            retries=len(retries.history) if retries else 0,
+        )
+
+    def summary(self) -> pd.DataFrame:
+        """One row per call name: counts, latency percentiles over recent calls, phase averages and volumes"""
+        with self._lock:
+            events = pd.DataFrame(list(self._events))
+            totals = {call: dict(values) for call, values in self._totals.items()}
+        if events.empty:
+            return pd.DataFrame()
+        latency = events.groupby('call')['seconds'].quantile([0.5, 0.95, 0.99]).unstack()
+        rows = []
+        for call, values in sorted(totals.items()):
+            count = values['count']
+            rows.append({
+                'call': call,
+                'calls': count,
+                'errors': values['errors'],
+                'retries': values['retries'],
+                'p50 ms': latency.loc[call, 0.5] * 1000 if call in latency.index else None,
+                'p95 ms': latency.loc[call, 0.95] * 1000 if call in latency.index else None,
+                'p99 ms': latency.loc[call, 0.99] * 1000 if call in latency.index else None,
+                **{f"{phase} ms": values[phase] / count * 1000 for phase in METRICS_PHASES},
+                'server ms': values['server'] / values['server_timed'] * 1000 if values['server_timed'] else None,
+                'MB sent': values['bytes_sent'] / 1024 ** 2,
+                'MB received': values['bytes_received'] / 1024 ** 2,
+                'rows': values['rows'],
+                'statuses': ", ".join(f"{status}×{n}" for status, n in sorted(values['status'].items())),
+            })
+        return pd.DataFrame(rows)
+
+    def to_prometheus(self, prefix: str = "datasette_uploader") -> str:
+        """Totals in the Prometheus text exposition format"""
+        with self._lock:
+            totals = {call: dict(values) for call, values in self._totals.items()}
+        lines = []
+
+        def family(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        family("requests_total", "counter", "API calls by call name and HTTP status (0 = no response)")
+        for call, values in totals.items():
+            for status, count in sorted(values['status'].items()):
+                lines.append(f'{prefix}_requests_total{{call="{call}",status="{status}"}} {count}')
+        family("request_duration_seconds", "histogram", "Call latency including body serialization")
+        for call, values in totals.items():
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, float('inf')), values['buckets']):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_request_duration_seconds_bucket{{call="{call}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_request_duration_seconds_sum{{call="{call}"}} {values["seconds"]}')
+            lines.append(f'{prefix}_request_duration_seconds_count{{call="{call}"}} {values["count"]}')
+        family("phase_seconds_total", "counter", "Time spent per phase: serialize, ttfb (time to first byte), download")
+        for call, values in totals.items():
+            for phase in METRICS_PHASES:
+                lines.append(f'{prefix}_phase_seconds_total{{call="{call}",phase="{phase}"}} {values[phase]}')
+        family("server_seconds_total", "counter", "Server time from Server-Timing headers, over server_timed_total calls")
+        for call, values in totals.items():
+            lines.append(f'{prefix}_server_seconds_total{{call="{call}"}} {values["server"]}')
+        for key, help_text in (
+            ('bytes_sent', "Request body bytes as sent"),
+            ('bytes_received', "Response body bytes as received"),
+            ('rows', "Rows carried by write calls"),
+            ('retries', "Retries made by the HTTP client"),
+            ('server_timed', "Calls whose response had a Server-Timing header"),
+            ('errors', "Calls that failed or returned an error status"),
+        ):
+            family(f"{key}_total", "counter", help_text)
+            for call, values in totals.items():
+                lines.append(f'{prefix}_{key}_total{{call="{call}"}} {values[key]}')
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self) -> str:
+        """The recent calls, one JSON object per line"""
+        with self._lock:
+            events = list(self._events)
+        return "".join(json.dumps(event) + "\n" for event in events)
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+            self._totals.clear()
+            self.started = time.time()
+
+
+class DatasetteUploader:
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str] = None,
+        batch_rows: int = DEFAULT_BATCH_ROWS,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        session: Optional[requests.Session] = None,
+        metadata_cache: Optional[MetadataCache] = None,
+        compression: Optional[str] = None,
+        metrics: Optional[UploadMetrics] = None,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.metrics = metrics
+        # Content-Encoding for write bodies; only useful when the server or
+        # a proxy in front of it decodes compressed requests
+        self.compression = compression
+        self.compression_checked = False
+        self.headers = {}
+        if token:
+            self.headers['Authorization'] = f'Bearer {token}'
+        self.batch_rows = max(1, int(batch_rows))
+        self.batch_bytes = max(1, int(batch_bytes))
+        self.max_in_flight = max(1, int(max_in_flight))
+        # Every call goes through one pooled keep-alive session, so requests
+        # reuse connections instead of paying a TCP/TLS handshake each
+        self.session = session or make_session(token, pool_size=max(DEFAULT_POOL_SIZE, self.max_in_flight))
+        self.metadata_cache = metadata_cache or MetadataCache()
+
+    def _request(self, method: str, url: str, call: str, rows: int = 0, serialize: float = 0.0, **kwargs) -> requests.Response:
+        """session.request, timed and recorded under call when metrics are enabled"""
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception as e:
+            self.metrics.record(call, time.perf_counter() - started, serialize=serialize, rows=rows, error=type(e).__name__)
+            raise
+        self.metrics.record_response(call, response, time.perf_counter() - started, serialize, rows)
+        return response
+
+    def _get_metadata(self, path: str) -> Optional[Any]:
+        """
+        GET a metadata JSON document through the metadata cache.
+        Returns None when the instance answers with anything but 200/304.
+        """
+        key = (self.base_url, self.token, path)
+        fresh, entry = self.metadata_cache.lookup(key)
+        if fresh:
+            return entry['data']
+
+        headers = {'If-None-Match': entry['etag']} if entry and entry['etag'] else {}
+        response = self._request('GET', f"{self.base_url}{path}", 'metadata', headers=headers)
+        if response.status_code == 304 and entry:
+            self.metadata_cache.refresh(key)
+            return entry['data']
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        self.metadata_cache.store(key, data, response.headers.get('ETag'))
+        return data
+
+    def invalidate_metadata(self, database: Optional[str] = None):
+        """Drop cached listings after a write that changes them"""
+        self.metadata_cache.invalidate(self.base_url, database)
+    
+    def get_databases(self) -> List[str]:
+        """Get list of databases from Datasette instance"""
+        try:
+            data = self._get_metadata("/.json")
+            if data is not None:
+                return list(data.get('databases', {}))
+            return []
+        except Exception as e:
+            logger.error(f"Error fetching databases: {e}")
+            return []
+    
+    def get_tables(self, database: str) -> List[str]:
+        """Get list of tables from a specific database"""
+        try:
+            data = self._get_metadata(f"/{database}.json")
+            if data is not None:
+                return [table['name'] for table in data.get('tables', [])]
+            return []
+        except Exception as e:
+            logger.error(f"Error fetching tables: {e}")
+            return []
+    
+    def get_table_schema(self, database: str, table: str) -> Dict:
+        """Get table schema information"""
+        try:
+            data = self._get_metadata(f"/{database}/{table}.json?_=schema")
+            if data is not None:
+                return data.get('rows', [])
+            return []
+        except Exception as e:
+            logger.error(f"Error fetching table schema: {e}")
+            return []
+
+    def get_table_columns(self, database: str, table: str) -> List[Dict[str, Any]]:
+        """Column name, declared type, notnull and pk position, via pragma_table_info"""
+        query = urllib.parse.urlencode({
+            'sql': 'select name, type, "notnull", pk from pragma_table_info(:table)',
+            'table': table,
+            '_shape': 'array',
+        })
+        try:
+            return self._get_metadata(f"/{database}.json?{query}") or []
+        except Exception:
+            return []
+
+    def get_column_types(self, database: str, table: str) -> Dict[str, str]:
+        """Map column name to declared SQLite type"""
+        return {col['name']: col['type'] for col in self.get_table_columns(database, table)}
+    
+    def _encode_rows(self, df: pd.DataFrame, extra: Optional[Dict[str, Any]] = None) -> Tuple[bytes, bytes]:
+        """Encode a slice of the DataFrame as a write API JSON body; returns (wire, raw)"""
+        raw = encode_json_body(df, extra)
+        return compress_body(raw, self.compression), raw
+
+    def _iter_batches(self, df: pd.DataFrame, extra: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[int, int, bytes, bytes]]:
+        """Yield (start, end, wire, raw) batches of df sized by batch_rows/batch_bytes"""
+        return iter_wire_batches(df, self.batch_rows, self.batch_bytes, extra, self.compression)
+
+    def _send_batch(
+        self, url: str, start: int, end: int, body: bytes, raw: Optional[bytes] = None, serialize: float = 0.0
+    ) -> Dict[str, Any]:
+        """
+        POST one encoded batch (compressed when raw is given) and describe
+        the outcome. serialize is the time spent encoding it, for metrics.
+        """
+        batch = {'start': start, 'end': end, 'rows': end - start, 'bytes': len(body), 'raw_bytes': len(raw or body)}
+        try:
+            headers = {'Content-Type': 'application/json'}
+            if raw is not None and body is not raw:
+                headers['Content-Encoding'] = self.compression
+            response = self._request(
+                'POST', url, url.rsplit('/-/', 1)[-1], rows=end - start, serialize=serialize,
+                headers=headers, data=body,
+            )
+            batch['status_code'] = response.status_code
+            batch['success'] = response.status_code in [200, 201]
+            batch['response'] = response.text
+        except Exception as e:
+            batch['success'] = False
+            batch['error'] = str(e)
+        return batch
+
+    def check_compression(self, url: str, endpoint: str) -> bool:
+        """
+        Probe whether compressed bodies reach Datasette decoded, by sending
+        a compressed empty object to the write endpoint (create, insert or
+        upsert at url) the upload will use. Only the validation error from
+        COMPRESSION_PROBE_ERRORS shows the body was read; a 500 from an
+        undecodable body, or a 403/404 from before the body is read, does
+        not, and compression is switched off for this uploader. Sent
+        through the shared session like any write, so dropped connections
+        and 429/503 are retried (an undecodable body's 500 is not). A
+        confirmed result is remembered, so the probe runs once per uploader.
+        """
+        if not self.compression or self.compression_checked:
+            return bool(self.compression)
+        try:
+            response = self._request(
+                'POST', url, 'compression_probe',
+                headers={**self.headers, 'Content-Type': 'application/json', 'Content-Encoding': self.compression},
+                data=compress_body(b'{}', self.compression),
+            )
+            decoded = probe_decoded(response.status_code, response.json(), endpoint)
+        except Exception:
+            decoded = False
+        if decoded:
+            self.compression_checked = True
+        else:
+            self.compression = None
+        return decoded
+
+    def _bulk_write(
+        self,
+        database: str,
+        table: str,
+        data: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        create: bool = False,
+        progress: Optional[ProgressCallback] = None,
+        endpoint: str = "insert",
+        create_options: Optional[Dict[str, Any]] = None,
+        write_options: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Send rows to Datasette in batches over the shared session.
+
+        data is a DataFrame or an iterable of DataFrame chunks (e.g. from
+        iter_file_chunks); chunks are pulled lazily so a file never has to be
+        held in memory at once. For chunked input the progress callback gets
+        total=None since the row count is only known at the end.
+
+        With create=True the first batch goes to /-/create and must succeed
+        before the remaining batches are appended through /-/insert (or
+        /-/upsert with endpoint="upsert"). create_options and write_options
+        are extra keys for the /-/create and insert/upsert bodies, e.g.
+        {"pk": "id"} or {"replace": True}. At most max_in_flight batches are
+        encoded and in flight at any time.
+        """
+        create_url = f"{self.base_url}/{database}/-/create"
+        write_url = f"{self.base_url}/{database}/{table}/-/{endpoint}"
+        compression_refused = bool(self.compression) and not self.check_compression(
+            create_url if create else write_url, 'create' if create else endpoint
+        )
+        if isinstance(data, pd.DataFrame):
+            chunks: Iterable[pd.DataFrame] = [data]
+            expected: Optional[int] = len(data)
+        else:
+            chunks, expected = data, None
+        rows_read = 0
+        done_rows = 0
+        batches: List[Dict[str, Any]] = []
+        started = time.perf_counter()
+
+        def record(batch: Dict[str, Any]):
+            nonlocal done_rows
+            batches.append(batch)
+            if batch.get('success'):
+                done_rows += batch['rows']
+            if progress:
+                progress(done_rows, expected, batch)
+
+        def generate() -> Iterator[Tuple[str, int, int, bytes, bytes, float]]:
+            nonlocal rows_read
+            pending_create = create
+            for chunk in chunks:
+                offset = rows_read
+                rows_read += len(chunk)
+                skip = 0
+                if pending_create and len(chunk):
+                    # The table must exist before any insert batch is sent
+                    skip = min(self.batch_rows, len(chunk))
+                    encode_started = time.perf_counter()
+                    wire, raw = self._encode_rows(chunk.iloc[:skip], {"table": table, **(create_options or {})})
+                    serialize = time.perf_counter() - encode_started
+                    record(self._send_batch(create_url, offset, offset + skip, wire, raw, serialize))
+                    if not batches[-1]['success']:
+                        return
+                    pending_create = False
+                batches_iter = self._iter_batches(chunk.iloc[skip:], write_options)
+                while True:
+                    encode_started = time.perf_counter()
+                    item = next(batches_iter, None)
+                    if item is None:
+                        break
+                    start, end, wire, raw = item
+                    serialize = time.perf_counter() - encode_started
+                    yield write_url, offset + skip + start, offset + skip + end, wire, raw, serialize
+
+        self._run_pipelined(self._send_batch, generate(), record)
+        if any(b.get('success') for b in batches):
+            self.invalidate_metadata(database)
+        result = self._summarize_batches(batches, rows_read, started)
+        if compression_refused:
+            result['warning'] = COMPRESSION_REFUSED
+        if create and not batches:
+            result.update(success=False, error="No rows to upload")
+        return result
+
+    def _run_pipelined(self, fn: Callable[..., Any], items: Iterable[Tuple], on_result: Callable[[Any], None]):
+        """
+        Call fn(*args) for each args tuple on a worker pool, keeping at most
+        max_in_flight calls pending. items is consumed lazily so large inputs
+        are never materialized up front; on_result runs in the calling thread.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            pending = set()
+            for args in items:
+                if len(pending) >= self.max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        on_result(future.result())
+                pending.add(pool.submit(fn, *args))
+            for future in as_completed(pending):
+                on_result(future.result())
+
+    @staticmethod
+    def _summarize_batches(batches: List[Dict[str, Any]], total: int, started: float) -> Dict[str, Any]:
+        """Aggregate per-batch outcomes into a single result dict"""
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        batches = sorted(batches, key=lambda b: b['start'])
+        failed = [b for b in batches if not b.get('success')]
+        rows_written = sum(b['rows'] for b in batches if b.get('success'))
+        bytes_sent = sum(b['bytes'] for b in batches)
+        raw_bytes = sum(b.get('raw_bytes', b['bytes']) for b in batches)
+        last = failed[0] if failed else (batches[-1] if batches else {})
+
+        result = {
+            'success': not failed and rows_written == total,
+            'status_code': last.get('status_code'),
+            'response': last.get('response', ''),
+            'rows_total': total,
+            'rows_written': rows_written,
+            'batches': len(batches),
+            'failed_batches': [
+                {
+                    'start': b['start'],
+                    'end': b['end'],
+                    'status_code': b.get('status_code'),
+                    'error': b.get('error', b.get('response')),
+                }
+                for b in failed
+            ],
+            'bytes_sent': bytes_sent,
+            'raw_bytes': raw_bytes,
+            'compression_ratio': raw_bytes / bytes_sent if bytes_sent else 1.0,
+            'elapsed': elapsed,
+            'rows_per_sec': rows_written / elapsed,
+            'bytes_per_sec': bytes_sent / elapsed,
+        }
+        if failed:
+            ranges = ", ".join(f"{b['start']}-{b['end'] - 1}" for b in failed)
+            result['error'] = f"{len(failed)} of {len(batches)} batches failed (rows {ranges}): {last.get('error', last.get('response'))}"
+        return result
+
+    def create_table(
+        self,
+        database: str,
+        table_name: str,
+        df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        progress: Optional[ProgressCallback] = None,
+        pk: Optional[Union[str, List[str]]] = None,
+        columns: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Create a new table with data from a DataFrame or DataFrame chunks, sending rows in batches.
+        pk names the primary key column(s); without it Datasette creates a rowid table.
+
+        columns is an explicit schema ([{'name', 'type'}], e.g. from
+        infer_schema): the table is created empty with those types and the
+        rows, coerced to them, are then inserted. Without it Datasette
+        infers types from the first batch. The write API has no NOT NULL,
+        so 'not_null' entries are ignored here.
+        """
+        try:
+            if not columns:
+                return self._bulk_write(database, table_name, df, create=True, progress=progress, create_options=pk_options(pk))
+            body = {
+                "table": table_name,
+                "columns": [{"name": col['name'], "type": col['type']} for col in columns],
+                **pk_options(pk),
+            }
+            response = self._request(
+                'POST', f"{self.base_url}/{database}/-/create", 'create',
+                headers={'Content-Type': 'application/json'},
+                data=dumps_json(body),
+            )
+            if response.status_code not in (200, 201):
+                return {'success': False, 'status_code': response.status_code, 'error': response.text[:500]}
+            self.invalidate_metadata(database)
+            if isinstance(df, pd.DataFrame):
+                rows = coerce_to_schema(df, columns)
+            else:
+                rows = (coerce_to_schema(chunk, columns) for chunk in df)
+            return self._bulk_write(database, table_name, rows, progress=progress)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def insert_rows(
+        self,
+        database: str,
+        table: str,
+        df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        progress: Optional[ProgressCallback] = None,
+        replace: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Insert rows from a DataFrame or DataFrame chunks into existing table, sending rows in batches.
+        With replace=True rows whose primary key already exists are replaced instead of rejected.
+        """
+        try:
+            return self._bulk_write(database, table, df, progress=progress, write_options={"replace": True} if replace else None)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def drop_table(self, database: str, table: str, confirm: bool = False) -> Dict[str, Any]:
+        """Drop a table from the given database."""
+        try:
+            url = f"{self.base_url}/{database}/{table}/-/drop"
+            payload = {"confirm": True} if confirm else {}
+
+            response = self._request(
+                'POST', url, 'drop',
+                headers={'Content-Type': 'application/json'},
+                json=payload
+            )
+            if response.status_code == 200:
+                self.invalidate_metadata(database)
+
+            return {
+                'success': response.status_code == 200,
+                'status_code': response.status_code,
+                'response': response.json() if response.headers.get("Content-Type") == "application/json" else response.text
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def update_rows(self, database: str, table: str, pk_values: List[str], updates: Dict[str, Any], return_row: bool = True) -> Dict[str, Any]:
+        """Update a row in a table by primary key(s)."""
+        try:
+            # Tilde-encode PKs (Datasette requirement)
+            row_pks = ",".join([urllib.parse.quote(pk, safe="") for pk in pk_values])
+
+            url = f"{self.base_url}/{database}/{table}/{row_pks}/-/update"
+            payload = {
+                "update": updates
+            }
+            if return_row:
+                payload["return"] = True
+
+            response = self._request(
+                'POST', url, 'update', rows=1,
+                headers={'Content-Type': 'application/json'},
+                data=dumps_json(payload)
+            )
+
+            return {
+                "success": response.status_code == 200,
+                "status_code": response.status_code,
+                "response": response.json() if response.headers.get("Content-Type") == "application/json" else response.text
+            }
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+
+    def bulk_update(
+        self,
+        database: str,
+        table: str,
+        df: pd.DataFrame,
+        pk_cols: List[str],
+        use_upsert: bool = False,
+        progress: Optional[ProgressCallback] = None,
+        staged: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Update many rows identified by pk_cols.
+
+        By default each row is sent to /-/update by a pool of at most
+        max_in_flight concurrent workers. With use_upsert=True the rows are
+        sent as /-/upsert batches instead, which is far fewer requests but
+        inserts rows whose key does not exist yet. With staged=True the rows
+        are uploaded to a staging table and applied by a single UPDATE ...
+        FROM statement (see _apply_staged), which only reports totals.
+
+        Returns a result dict whose 'status' entry is a DataFrame with one
+        row per input row: the key columns, 'success', 'status_code' and
+        'error'.
+        """
+        if staged:
+            return self._staged_update(database, table, df, pk_cols, progress)
+        total = len(df)
+        started = time.perf_counter()
+        success = np.zeros(total, dtype=bool)
+        status_codes = np.zeros(total, dtype=np.int64)
+        errors = np.full(total, None, dtype=object)
+
+        if use_upsert:
+            def record_batch(done: int, total_rows: int, batch: Dict[str, Any]):
+                rows = slice(batch['start'], batch['end'])
+                success[rows] = bool(batch.get('success'))
+                status_codes[rows] = batch.get('status_code') or 0
+                if not batch.get('success'):
+                    errors[rows] = batch.get('error', batch.get('response'))
+                if progress:
+                    progress(done, total_rows, batch)
+
+            self._bulk_write(database, table, df, progress=record_batch, endpoint="upsert")
+        else:
+            # Vectorized extraction: one pass per column rather than a Series per row
+            pk_values = list(zip(*(df[pk].astype(str) for pk in pk_cols)))
+            updates = list(iter_records(df.drop(columns=pk_cols)))
+            done_rows = 0
+
+            def update_one(i: int) -> Tuple[int, Dict[str, Any]]:
+                return i, self.update_rows(database, table, list(pk_values[i]), updates[i], return_row=False)
+
+            def record_row(outcome: Tuple[int, Dict[str, Any]]):
+                nonlocal done_rows
+                i, result = outcome
+                success[i] = bool(result.get('success'))
+                status_codes[i] = result.get('status_code') or 0
+                if not result.get('success'):
+                    errors[i] = result.get('error', result.get('response'))
+                done_rows += 1
+                if progress:
+                    progress(done_rows, total, {'start': i, 'end': i + 1, 'rows': 1, **result})
+
+            self._run_pipelined(update_one, ((i,) for i in range(total)), record_row)
+
+        status = df[pk_cols].reset_index(drop=True).assign(
+            success=success, status_code=status_codes, error=errors
+        )
+        failed = int(total - success.sum())
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        result = {
+            'success': failed == 0,
+            'rows_total': total,
+            'rows_updated': total - failed,
+            'rows_failed': failed,
+            'elapsed': elapsed,
+            'rows_per_sec': (total - failed) / elapsed,
+            'status': status,
+        }
+        if failed:
+            result['error'] = f"{failed} of {total} rows failed to update"
+        return result
+
+
+    def _apply_staged(
+        self,
+        database: str,
+        rows: pd.DataFrame,
+        pk_cols: List[str],
+        statement: Callable[[str], str],
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        Upload rows to a new staging table keyed on pk_cols with the usual
+        batched inserts, run the one write statement built by
+        statement(staging_name) through datasette-write, and drop the staging
+        table again, also when something failed. A single statement is its
+        own transaction, so the target table sees all of the change or none.
+        Needs create-table, insert-row and datasette-write permissions.
+        """
+        staging = f"_staging_{uuid.uuid4().hex[:12]}"
+        staged = self._bulk_write(database, staging, rows, create=True, progress=progress, create_options=pk_options(pk_cols))
+        if staged.get('success'):
+            result = self.execute_write(database, statement(staging))
+        else:
+            result = {
+                'success': False,
+                'status_code': staged.get('status_code') or 0,
+                'error': f"Staging the rows failed: {staged.get('error', staged.get('response'))}",
+            }
+        result['requests'] = staged.get('batches', 0) + 2
+        dropped = self.execute_write(database, f"DROP TABLE IF EXISTS {quote_identifier(staging)}")
+        if not dropped['success']:
+            logger.warning(f"Could not drop staging table {staging}: {dropped.get('error')}")
+            result['staging_table'] = staging
+        self.invalidate_metadata(database)
+        return result
+
+    def _staged_update(
+        self,
+        database: str,
+        table: str,
+        df: pd.DataFrame,
+        pk_cols: List[str],
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """bulk_update(staged=True): stage the rows, then one UPDATE ... FROM"""
+        started = time.perf_counter()
+        value_cols = [col for col in df.columns if col not in pk_cols]
+        complete = df[pk_cols].notna().all(axis=1)
+        # The staging key is unique, so when a key repeats its last row wins
+        rows = df[complete].drop_duplicates(pk_cols, keep='last').reset_index(drop=True)
+        total = len(rows)
+        if not value_cols:
+            result = {'success': False, 'status_code': 0, 'error': NO_VALUE_COLUMNS}
+        elif not total:
+            result = {'success': True, 'rows_affected': 0, 'requests': 0}
+        else:
+            result = self._apply_staged(
+                database, rows, pk_cols,
+                lambda staging: staged_update_sql(table, staging, pk_cols, value_cols),
+                progress,
+            )
+        ok = bool(result['success'])
+        updated = (result.get('rows_affected') or 0) if ok else 0
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        summary = {
+            'success': ok,
+            'rows_total': total,
+            'rows_updated': updated,
+            'rows_missing': total - updated if ok else 0,
+            'rows_failed': 0 if ok else total,
+            'null_keys': int((~complete).sum()),
+            'duplicate_keys': int(complete.sum()) - total,
+            'requests': result.get('requests', 0),
+            'elapsed': elapsed,
+            'rows_per_sec': updated / elapsed,
+            'status': rows[pk_cols].assign(
+                success=ok, status_code=result.get('status_code') or 0, error=None if ok else result.get('error')
+            ),
+        }
+        if not ok:
+            summary['error'] = result.get('error')
+        if result.get('staging_table'):
+            summary['staging_table'] = result['staging_table']
+        return summary
+
+    def delete_rows(self, database: str, table: str, row_pks: List[Any]) -> Dict[str, Any]:
+        """
+        Delete a row by primary key(s) from a Datasette table.
+        - database: name of the Datasette database
+        - table: table name
+        - row_pks: list of primary key values (single value for single PK, list for composite PK)
+        """
+        try:
+            pk_path = delete_pk_path(row_pks)
+            url = f"{self.base_url}/{database}/{table}/{pk_path}/-/delete"
+            resp = self._request('POST', url, 'delete', headers={"Content-Type": "application/json"}, json={})
+            resp.raise_for_status()
+
+            return resp.json()
+
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+    
+    def execute_write(self, database: str, sql: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Run a write SQL statement through the datasette-write plugin.
+
+        The plugin answers with a redirect and reports the outcome in a
+        message cookie, e.g. "3 rows affected"; rows_affected is parsed from
+        it when present.
+        """
+        data = {'sql': sql, **{f"qp_{name}": value for name, value in (params or {}).items()}}
+        try:
+            resp = self._request('POST', f"{self.base_url}/{database}/-/write", 'write_sql', data=data, allow_redirects=False)
+            # Messages accumulate in the cookie; the last one is this statement's
+            messages = parse_write_messages(resp)
+            self.session.cookies.pop('ds_messages', None)
+            if resp.status_code >= 400:
+                return {'success': False, 'status_code': resp.status_code, 'error': resp.text[:500]}
+            if not messages:
+                return {'success': False, 'status_code': resp.status_code, 'error': "No result reported; is datasette-write installed?"}
+            message, message_type = messages[-1]
+            if message_type == 3:
+                return {'success': False, 'status_code': 400, 'error': message}
+            affected = message.split(' ', 1)[0]
+            return {
+                'success': True,
+                'status_code': resp.status_code,
+                'message': message,
+                'rows_affected': int(affected) if affected.isdigit() else None,
+            }
+        except Exception as e:
+            return {'success': False, 'status_code': 0, 'error': str(e)}
+
+    def bulk_delete(
+        self,
+        database: str,
+        table: str,
+        keys: pd.DataFrame,
+        pk_cols: List[str],
+        use_sql: bool = False,
+        chunk_size: int = DEFAULT_DELETE_CHUNK,
+        progress: Optional[ProgressCallback] = None,
+        staged: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Delete every row whose primary key appears in keys.
+
+        Keys are deduplicated first. By default each key is sent to
+        /-/delete by up to max_in_flight concurrent workers, so the status
+        says per key whether the row existed. With use_sql=True keys are
+        deleted chunk_size at a time with one DELETE ... IN (...) statement
+        per chunk through datasette-write (needs its permission); far fewer
+        requests, but only the chunk's total row count is known. With
+        staged=True the keys are uploaded to a staging table and deleted by
+        one DELETE ... IN (SELECT ...) statement (see _apply_staged).
+        """
+        started = time.perf_counter()
+        unique, null_keys, duplicates = dedupe_keys(keys, pk_cols)
+        # A 404 for a misspelled table would otherwise look like a missing key
+        if table not in self.get_tables(database):
+            return missing_table_deletes(unique, database, table, null_keys, duplicates, started)
+        total = len(unique)
+        success = np.zeros(total, dtype=bool)
+        status_codes = np.zeros(total, dtype=np.int64)
+        errors = np.full(total, None, dtype=object)
+        key_values = list(zip(*(unique[pk].astype(str) for pk in pk_cols))) if total else []
+        deleted = 0
+        done_rows = 0
+
+        if staged and total:
+            result = self._apply_staged(
+                database, unique, pk_cols, lambda staging: staged_delete_sql(table, staging, pk_cols), progress
+            )
+            success[:] = result['success']
+            status_codes[:] = result['status_code']
+            if result['success']:
+                deleted = result.get('rows_affected') or 0
+            else:
+                errors[:] = result['error']
+            missing = int(success.sum()) - deleted
+        elif use_sql:
+            step = max(1, min(chunk_size, SQLITE_MAX_PARAMS // len(pk_cols)))
+
+            def delete_chunk(start: int, end: int) -> Tuple[int, int, Dict[str, Any]]:
+                params = {f"p{i}": value for i, value in enumerate(v for key in key_values[start:end] for v in key)}
+                return start, end, self.execute_write(database, delete_keys_sql(table, pk_cols, end - start), params)
+
+            def record_chunk(outcome: Tuple[int, int, Dict[str, Any]]):
+                nonlocal deleted, done_rows
+                start, end, result = outcome
+                success[start:end] = result['success']
+                status_codes[start:end] = result['status_code']
+                if result['success']:
+                    deleted += result.get('rows_affected') or 0
+                    done_rows += end - start
+                else:
+                    errors[start:end] = result['error']
+                if progress:
+                    progress(done_rows, total, {'start': start, 'end': end, 'rows': end - start, **result})
+
+            chunks = ((start, min(start + step, total)) for start in range(0, total, step))
+            self._run_pipelined(delete_chunk, chunks, record_chunk)
+            missing = int(success.sum()) - deleted
+        else:
+            def delete_one(i: int) -> Tuple[int, Dict[str, Any]]:
+                url = f"{self.base_url}/{database}/{table}/{delete_pk_path(key_values[i])}/-/delete"
+                try:
+                    resp = self._request('POST', url, 'delete', json={})
+                    result = {'success': resp.ok, 'status_code': resp.status_code}
+                    if resp.status_code == 404 and f'"{RECORD_NOT_FOUND}' in resp.text:
+                        # Only a missing row; a missing table or database is a failure
+                        result['error'] = RECORD_NOT_FOUND
+                    elif not resp.ok:
+                        result['error'] = resp.text[:500]
+                    return i, result
+                except Exception as e:
+                    return i, {'success': False, 'status_code': 0, 'error': str(e)}
+
+            def record_row(outcome: Tuple[int, Dict[str, Any]]):
+                nonlocal deleted, done_rows
+                i, result = outcome
+                success[i] = result['success']
+                status_codes[i] = result['status_code']
+                errors[i] = result.get('error')
+                deleted += int(result['success'])
+                done_rows += 1
+                if progress:
+                    progress(done_rows, total, {'start': i, 'end': i + 1, 'rows': 1, **result})
+
+            self._run_pipelined(delete_one, ((i,) for i in range(total)), record_row)
+            missing = int((errors == RECORD_NOT_FOUND).sum())
+
+        if deleted:
+            self.invalidate_metadata(database)
+        return summarize_deletes(unique, success, status_codes, errors, deleted, missing, null_keys, duplicates, started)
+
+    def _fetch_page(self, database: str, table: str, params: List[Tuple[str, Any]]) -> Dict[str, Any]:
+        response = self._request('GET', f"{self.base_url}/{database}/{table}.json", 'rows', params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_table_rows(
+        self,
+        database: str,
+        table: str,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        max_rows: Optional[int] = None,
+        prefetch: bool = False,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Yield a table's rows as DataFrame chunks, one per page, following
+        Datasette's _next keyset pagination.
+
+        - columns: restrict to these columns (_col); primary keys are always returned
+        - filters: extra Datasette query arguments, e.g. {"age__gt": 30}
+        - max_rows: stop after this many rows
+        - prefetch: request the next page while the caller processes the current one
+        """
+        if max_rows is not None:
+            page_size = max(1, min(page_size, max_rows))
+        params: List[Tuple[str, Any]] = [('_shape', 'objects'), ('_size', page_size)]
+        params += [('_col', col) for col in columns or []]
+        params += list((filters or {}).items())
+
+        def fetch(next_token: Optional[str]) -> Dict[str, Any]:
+            return self._fetch_page(database, table, params + ([('_next', next_token)] if next_token else []))
+
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = fetch(None)
+            yielded = 0
+            while True:
+                next_token = page.get('next')
+                rows = page.get('rows', [])
+                if max_rows is not None:
+                    rows = rows[:max_rows - yielded]
+                done = not next_token or (max_rows is not None and yielded + len(rows) >= max_rows)
+                upcoming = pool.submit(fetch, next_token) if pool and not done else None
+                if rows:
+                    yielded += len(rows)
+                    yield pd.DataFrame(rows)
+                if done:
+                    return
+                page = upcoming.result() if upcoming else fetch(next_token)
+        finally:
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def count_rows(self, database: str, table: str, filters: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """Return the table's row count without fetching any rows"""
+        try:
+            params = [('_size', 0), ('_extra', 'count')] + list((filters or {}).items())
+            return self._fetch_page(database, table, params).get('count')
+        except Exception:
+            return None
+
+    def get_table_rows(
+        self,
+        database: str,
+        table: str,
+        limit: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> pd.DataFrame:
+        """Fetch rows from a table, following pagination up to limit rows"""
+        try:
+            chunks = list(self.iter_table_rows(
+                database, table, columns=columns, filters=filters, max_rows=limit, prefetch=True
+            ))
+            return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        except Exception as e:
+            logger.error(f"Error fetching table rows: {e}")
+            return pd.DataFrame()
+
+
+# Pragmas applied to every local connection: WAL lets readers continue during
+# a load, and the larger cache/mmap keep index pages in memory while inserting
+# Applied to connections that write; journal_mode is stored in the file,
+# so read-only use leaves the database exactly as it was
+LOCAL_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-262144",  # 256 MB
+    "PRAGMA mmap_size=1073741824",  # 1 GB
+)
+LOCAL_DB_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+# Datasette filter suffixes supported by LocalSQLiteUploader.iter_table_rows
+LOCAL_FILTER_OPERATORS = {
+    'exact': '=', 'not': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<=', 'like': 'LIKE',
+}
+
+def quote_identifier(name: str) -> str:
+    """Quote a table or column name for use in SQLite SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sqlite_column_type(series: pd.Series) -> str:
+    """Pick the SQLite storage type for a DataFrame column"""
+    kind = series.dtype.kind
+    if kind in 'iub':
+        return 'INTEGER'
+    if kind == 'f':
+        return 'REAL'
+    return 'TEXT'
+
+# Rows scanned to infer column types for a new table
+DEFAULT_SCHEMA_SAMPLE = 20_000
+# Column types accepted by Datasette's /-/create "columns"
+SCHEMA_TYPES = ['integer', 'float', 'text', 'blob']
+# Integers beyond this many digits do not fit SQLite's 64-bit INTEGER
+MAX_INTEGER_DIGITS = 18
+SCHEMA_SQLITE_TYPES = {'integer': 'INTEGER', 'float': 'REAL', 'text': 'TEXT', 'blob': 'BLOB'}
+
+def _infer_column_type(series: pd.Series) -> str:
+    """Narrowest SCHEMA_TYPES entry that holds every non-null value of series"""
+    values = series.dropna()
+    if values.empty:
+        return 'text'
+    kind = values.dtype.kind
+    if kind in 'iub':
+        return 'integer'
+    if kind == 'f':
+        return 'integer' if (values % 1 == 0).all() and values.abs().max() < 2 ** 53 else 'float'
+    if kind in 'mM':
+        return 'text'
+    if values.map(type).isin([bytes, bytearray]).all():
+        return 'blob'
+    text = values.astype(str).str.strip()
+    numbers = pd.to_numeric(text, errors='coerce')
+    if numbers.isna().any():
+        return 'text'
+    digits = text.str.lstrip('+-')
+    # Codes such as "00123" or long account numbers must stay text
+    if (digits.str.match(r'0\d') | (digits.str.len() > MAX_INTEGER_DIGITS)).any():
+        return 'text'
+    # "3.0" is how a float-typed export writes an integer column with gaps
+    return 'integer' if ((numbers % 1 == 0) & (numbers.abs() < 2 ** 63)).all() else 'float'
+
+def infer_schema(df: pd.DataFrame, sample_rows: int = DEFAULT_SCHEMA_SAMPLE) -> Dict[str, Any]:
+    """
+    Infer a table schema from a DataFrame, or a random sample of it for
+    large frames. Works best on columns read as text (see preview_file's
+    as_text) so leading zeros are still visible.
+
+    Returns {'columns': [{'name', 'type', 'not_null'}], 'pk': [...]}, where
+    pk is a suggestion: the first integer or text column, preferring one
+    named like an id, that is complete and unique in the sample.
+    """
+    if len(df) > sample_rows:
+        df = df.sample(sample_rows, random_state=0)
+    columns = [
+        {'name': col, 'type': _infer_column_type(df[col]), 'not_null': bool(len(df)) and bool(df[col].notna().all())}
+        for col in df.columns
+    ]
+    candidates = [
+        col['name'] for col in columns
+        if col['not_null'] and col['type'] in ('integer', 'text') and df[col['name']].is_unique
+    ]
+    candidates.sort(key=lambda name: name.lower() not in ('id', 'pk', 'key') and not name.lower().endswith('_id'))
+    return {'columns': columns, 'pk': candidates[:1]}
+
+def coerce_to_schema(df: pd.DataFrame, columns: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Cast df's columns to the schema types, column at a time. A column is
+    only cast when every value converts without loss; otherwise it is left
+    as is and SQLite's type affinity decides.
+    """
+    df = df.copy()
+    for column in columns:
+        name, kind = column['name'], column['type']
+        if name not in df:
+            continue
+        series = df[name]
+        if kind == 'text':
+            df[name] = series.astype('string').astype(object).where(series.notna(), None)
+            continue
+        if kind not in ('integer', 'float') or series.dtype.kind in ('iu' if kind == 'integer' else 'f'):
+            continue
+        numbers = pd.to_numeric(series, errors='coerce')
+        if (numbers.isna() & series.notna()).any():
+            continue
+        if kind == 'integer' and (numbers.dropna() % 1 == 0).all():
+            df[name] = numbers.astype('Int64')
+        elif kind == 'float':
+            df[name] = numbers.astype('float64')
+    return df
+
+class LocalSQLiteUploader:
+    """
+    Writes straight to SQLite database files in a directory, exposing the
+    same methods and result dicts as DatasetteUploader. Meant for
+    deployments where the app runs on the same host as the database files:
+    rows are loaded with executemany in one transaction per chunk instead
+    of going through the write API.
+
+    Databases are the *.db / *.sqlite files in the directory, named by
+    their file stem as Datasette names them.
+    """
+    def __init__(self, directory: str, defer_indexes: bool = True):
+        self.directory = directory
+        self.defer_indexes = defer_indexes
+
+    def _path(self, database: str) -> str:
+        for suffix in LOCAL_DB_SUFFIXES:
+            path = os.path.join(self.directory, database + suffix)
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"No database file for '{database}' in {self.directory}")
+
+    def _connect(self, database: str, write: bool = False) -> sqlite3.Connection:
+        """Read-only connection, or with write=True one tuned with LOCAL_SQLITE_PRAGMAS"""
+        if not write:
+            uri = 'file:' + urllib.parse.quote(os.path.abspath(self._path(database))) + '?mode=ro'
+            return sqlite3.connect(uri, uri=True, timeout=30, isolation_level=None)
+        conn = sqlite3.connect(self._path(database), timeout=30, isolation_level=None)
+        for pragma in LOCAL_SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def invalidate_metadata(self, database: Optional[str] = None):
+        """Nothing is cached for local files"""
+
+    def get_databases(self) -> List[str]:
+        """List database files in the directory, skipping hidden ones such as the upload journal"""
+        try:
+            return sorted(
+                os.path.splitext(name)[0]
+                for name in os.listdir(self.directory)
+                if name.endswith(LOCAL_DB_SUFFIXES) and not name.startswith('.')
+            )
+        except Exception as e:
+            logger.error(f"Error listing databases: {e}")
+            return []
+
+    def get_tables(self, database: str) -> List[str]:
+        """Get list of tables from a specific database"""
+        try:
+            with closing(self._connect(database)) as conn:
+                return [row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+                )]
+        except Exception as e:
+            logger.error(f"Error fetching tables: {e}")
+            return []
+
+    def get_table_schema(self, database: str, table: str) -> List[Dict[str, Any]]:
+        """Column definitions from PRAGMA table_info"""
+        try:
+            with closing(self._connect(database)) as conn:
+                conn.row_factory = sqlite3.Row
+                return [dict(row) for row in conn.execute(f"PRAGMA table_info({quote_identifier(table)})")]
+        except Exception as e:
+            logger.error(f"Error fetching table schema: {e}")
+            return []
+
+    def get_table_columns(self, database: str, table: str) -> List[Dict[str, Any]]:
+        """Column name, declared type, notnull and pk position"""
+        return self.get_table_schema(database, table)
+
+    def get_column_types(self, database: str, table: str) -> Dict[str, str]:
+        """Map column name to declared SQLite type"""
+        return {col['name']: col['type'] for col in self.get_table_columns(database, table)}
+
+    def _primary_keys(self, conn: sqlite3.Connection, table: str) -> List[str]:
+        info = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+        pks = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+        return pks or ['rowid']
+
+    def _write_chunks(
+        self,
+        conn: sqlite3.Connection,
+        table: str,
+        chunks: Iterable[pd.DataFrame],
+        expected: Optional[int],
+        create: bool,
+        progress: Optional[ProgressCallback],
+        pk: Optional[Union[str, List[str]]] = None,
+        replace: bool = False,
+        schema: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        batches: List[Dict[str, Any]] = []
+        started = time.perf_counter()
+        rows_read = done_rows = 0
+        for chunk in chunks:
+            if schema:
+                chunk = coerce_to_schema(chunk, schema)
+            if create and schema:
+                columns = [
+                    f"{quote_identifier(col['name'])} {SCHEMA_SQLITE_TYPES[col['type']]}" + (" NOT NULL" if col.get('not_null') else "")
+                    for col in schema
+                ]
+            elif create:
+                columns = [f"{quote_identifier(col)} {sqlite_column_type(chunk[col])}" for col in chunk.columns]
+            if create:
+                pks = [pk] if isinstance(pk, str) else list(pk or [])
+                if pks:
+                    columns.append(f"PRIMARY KEY ({', '.join(quote_identifier(col) for col in pks)})")
+                conn.execute(f"CREATE TABLE {quote_identifier(table)} ({', '.join(columns)})")
+                create = False
+            names = ", ".join(quote_identifier(col) for col in chunk.columns)
+            placeholders = ", ".join("?" * len(chunk.columns))
+            verb = "INSERT OR REPLACE" if replace else "INSERT"
+            sql = f"{verb} INTO {quote_identifier(table)} ({names}) VALUES ({placeholders})"
+            values = [_column_values(chunk.iloc[:, i]) for i in range(chunk.shape[1])]
+            batch = {'start': rows_read, 'end': rows_read + len(chunk), 'rows': len(chunk), 'bytes': 0}
+            rows_read += len(chunk)
+            try:
+                conn.execute("BEGIN")
+                conn.executemany(sql, zip(*values))
+                conn.execute("COMMIT")
+                batch.update(success=True, status_code=200)
+                done_rows += batch['rows']
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                batch.update(success=False, error=str(e))
+            batches.append(batch)
+            if progress:
+                progress(done_rows, expected, batch)
+        result = DatasetteUploader._summarize_batches(batches, rows_read, started)
+        if not batches:
+            result.update(success=False, error="No rows to upload")
+        return result
+
+    def _bulk_write(
+        self,
+        database: str,
+        table: str,
+        data: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        create: bool = False,
+        progress: Optional[ProgressCallback] = None,
+        pk: Optional[Union[str, List[str]]] = None,
+        replace: bool = False,
+        schema: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        if isinstance(data, pd.DataFrame):
+            chunks: Iterable[pd.DataFrame] = [data]
+            expected: Optional[int] = len(data)
+        else:
+            chunks, expected = data, None
+        with closing(self._connect(database, write=True)) as conn:
+            deferred = []
+            if self.defer_indexes and not create:
+                # Rebuilding a non-unique index once is much cheaper than
+                # maintaining it row by row; unique indexes enforce constraints
+                # so they stay in place
+                deferred = conn.execute(
+                    "SELECT m.name, m.sql FROM sqlite_master m JOIN pragma_index_list(?) i ON i.name = m.name "
+                    "WHERE m.type = 'index' AND m.sql IS NOT NULL AND i.[unique] = 0",
+                    (table,),
+                ).fetchall()
+                for name, _ in deferred:
+                    conn.execute(f"DROP INDEX {quote_identifier(name)}")
+            try:
+                return self._write_chunks(conn, table, chunks, expected, create, progress, pk, replace, schema)
+            finally:
+                for _, sql in deferred:
+                    conn.execute(sql)
+
+    def create_table(
+        self,
+        database: str,
+        table_name: str,
+        df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        progress: Optional[ProgressCallback] = None,
+        pk: Optional[Union[str, List[str]]] = None,
+        columns: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Create a new table and load the rows. Column types come from columns
+        ([{'name', 'type', 'not_null'}], e.g. from infer_schema) when given,
+        otherwise from the first chunk's dtypes.
+        """
+        try:
+            return self._bulk_write(database, table_name, df, create=True, progress=progress, pk=pk, schema=columns)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def insert_rows(
+        self,
+        database: str,
+        table: str,
+        df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        progress: Optional[ProgressCallback] = None,
+        replace: bool = False,
+    ) -> Dict[str, Any]:
+        """Insert rows from a DataFrame or DataFrame chunks into existing table, optionally replacing rows with the same key"""
+        try:
+            return self._bulk_write(database, table, df, progress=progress, replace=replace)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def drop_table(self, database: str, table: str, confirm: bool = False) -> Dict[str, Any]:
+        """Drop a table from the given database."""
+        try:
+            with closing(self._connect(database, write=True)) as conn:
+                conn.execute(f"DROP TABLE {quote_identifier(table)}")
+            return {'success': True, 'status_code': 200, 'response': {'ok': True}}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def update_rows(self, database: str, table: str, pk_values: List[str], updates: Dict[str, Any], return_row: bool = True) -> Dict[str, Any]:
+        """Update a row in a table by primary key(s)."""
+        try:
+            with closing(self._connect(database, write=True)) as conn:
+                pks = self._primary_keys(conn, table)
+                assignments = ", ".join(f"{quote_identifier(col)} = ?" for col in updates)
+                where = " AND ".join(f"{quote_identifier(pk)} = ?" for pk in pks)
+                cursor = conn.execute(
+                    f"UPDATE {quote_identifier(table)} SET {assignments} WHERE {where}",
+                    [*updates.values(), *pk_values],
+                )
+                if cursor.rowcount == 0:
+                    return {"success": False, "status_code": 404, "response": {"ok": False, "errors": ["Record not found"]}}
+                return {"success": True, "status_code": 200, "response": {"ok": True}}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def bulk_update(
+        self,
+        database: str,
+        table: str,
+        df: pd.DataFrame,
+        pk_cols: List[str],
+        use_upsert: bool = False,
+        progress: Optional[ProgressCallback] = None,
+        staged: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Update many rows identified by pk_cols in a single transaction.
+        With use_upsert=True rows whose key does not exist are inserted
+        (INSERT ... ON CONFLICT DO UPDATE, which needs a unique key on pk_cols).
+        staged is accepted for parity with DatasetteUploader; the rows are
+        already applied in one transaction.
+        """
+        total = len(df)
+        started = time.perf_counter()
+        success = np.zeros(total, dtype=bool)
+        errors = np.full(total, None, dtype=object)
+        value_cols = [col for col in df.columns if col not in pk_cols]
+        if not value_cols and not use_upsert:
+            # An UPDATE needs at least one column to SET
+            return {
+                'success': False,
+                'rows_total': total,
+                'rows_updated': 0,
+                'rows_failed': total,
+                'elapsed': 0.0,
+                'rows_per_sec': 0.0,
+                'status': df[pk_cols].reset_index(drop=True).assign(
+                    success=False, status_code=400, error=NO_VALUE_COLUMNS
+                ),
+                'error': NO_VALUE_COLUMNS,
+            }
+        pk_values = [_column_values(df[pk]) for pk in pk_cols]
+        values = [_column_values(df[col]) for col in value_cols]
+        quoted_table = quote_identifier(table)
+        if use_upsert:
+            names = ", ".join(quote_identifier(col) for col in [*pk_cols, *value_cols])
+            placeholders = ", ".join("?" * (len(pk_cols) + len(value_cols)))
+            conflict = ", ".join(quote_identifier(pk) for pk in pk_cols)
+            assignments = ", ".join(f"{quote_identifier(col)} = excluded.{quote_identifier(col)}" for col in value_cols)
+            sql = (
+                f"INSERT INTO {quoted_table} ({names}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({conflict}) DO " + (f"UPDATE SET {assignments}" if value_cols else "NOTHING")
+            )
+            params = zip(*pk_values, *values)
+        else:
+            assignments = ", ".join(f"{quote_identifier(col)} = ?" for col in value_cols)
+            where = " AND ".join(f"{quote_identifier(pk)} = ?" for pk in pk_cols)
+            sql = f"UPDATE {quoted_table} SET {assignments} WHERE {where}"
+            params = zip(*values, *pk_values)
+
+        try:
+            with closing(self._connect(database, write=True)) as conn:
+                conn.execute("BEGIN")
+                for i, row in enumerate(params):
+                    try:
+                        cursor = conn.execute(sql, row)
+                        success[i] = use_upsert or cursor.rowcount > 0
+                        if not success[i]:
+                            errors[i] = "Record not found"
+                    except sqlite3.Error as e:
+                        errors[i] = str(e)
+                    if progress and (i + 1) % DEFAULT_BATCH_ROWS == 0:
+                        progress(int(success[:i + 1].sum()), total, {'start': i, 'end': i + 1, 'rows': 1})
+                conn.execute("COMMIT")
+        except Exception as e:
+            success[:] = False
+            errors[:] = str(e)
+
+        status = df[pk_cols].reset_index(drop=True).assign(
+            success=success, status_code=np.where(success, 200, 400), error=errors
+        )
+        failed = int(total - success.sum())
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        result = {
+            'success': failed == 0,
+            'rows_total': total,
+            'rows_updated': total - failed,
+            'rows_failed': failed,
+            'elapsed': elapsed,
+            'rows_per_sec': (total - failed) / elapsed,
+            'status': status,
+        }
+        if failed:
+            result['error'] = f"{failed} of {total} rows failed to update"
+        return result
+
+    def delete_rows(self, database: str, table: str, row_pks: List[Any]) -> Dict[str, Any]:
+        """Delete a row by primary key(s)."""
+        try:
+            values = list(row_pks) if isinstance(row_pks, (list, tuple)) else [row_pks]
+            with closing(self._connect(database, write=True)) as conn:
+                pks = self._primary_keys(conn, table)
+                where = " AND ".join(f"{quote_identifier(pk)} = ?" for pk in pks)
+                deleted = conn.execute(f"DELETE FROM {quote_identifier(table)} WHERE {where}", values).rowcount
+            if deleted == 0:
+                return {"ok": False, "error": RECORD_NOT_FOUND}
+            return {"ok": True}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+    def bulk_delete(
+        self,
+        database: str,
+        table: str,
+        keys: pd.DataFrame,
+        pk_cols: List[str],
+        use_sql: bool = False,
+        chunk_size: int = DEFAULT_DELETE_CHUNK,
+        progress: Optional[ProgressCallback] = None,
+        staged: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Delete every row whose key appears in keys, in a single transaction.
+        use_sql, chunk_size and staged are accepted for parity with
+        DatasetteUploader.
+        """
+        started = time.perf_counter()
+        unique, null_keys, duplicates = dedupe_keys(keys, pk_cols)
+        if table not in self.get_tables(database):
+            return missing_table_deletes(unique, database, table, null_keys, duplicates, started)
+        total = len(unique)
+        success = np.zeros(total, dtype=bool)
+        status_codes = np.zeros(total, dtype=np.int64)
+        errors = np.full(total, None, dtype=object)
+        where = " AND ".join(f"{quote_identifier(pk)} = ?" for pk in pk_cols)
+        sql = f"DELETE FROM {quote_identifier(table)} WHERE {where}"
+        deleted = 0
+
+        try:
+            with closing(self._connect(database, write=True)) as conn:
+                conn.execute("BEGIN")
+                for i, key in enumerate(zip(*(_column_values(unique[pk]) for pk in pk_cols))):
+                    rowcount = conn.execute(sql, key).rowcount
+                    deleted += rowcount
+                    success[i] = rowcount > 0
+                    status_codes[i] = 200 if rowcount else 404
+                    if not rowcount:
+                        errors[i] = RECORD_NOT_FOUND
+                    if progress and (i + 1) % DEFAULT_BATCH_ROWS == 0:
+                        progress(i + 1, total, {'start': i, 'end': i + 1, 'rows': 1})
+                conn.execute("COMMIT")
+        except Exception as e:
+            success[:], status_codes[:], errors[:] = False, 0, str(e)
+            deleted = 0
+
+        missing = int((errors == RECORD_NOT_FOUND).sum())
+        return summarize_deletes(unique, success, status_codes, errors, deleted, missing, null_keys, duplicates, started)
+
+    def _where(self, filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for key, value in (filters or {}).items():
+            column, _, op = key.partition('__')
+            clauses.append(f"{quote_identifier(column)} {LOCAL_FILTER_OPERATORS[op or 'exact']} ?")
+            params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def iter_table_rows(
+        self,
+        database: str,
+        table: str,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        max_rows: Optional[int] = None,
+        prefetch: bool = False,
+    ) -> Iterator[pd.DataFrame]:
+        """Yield a table's rows as DataFrame chunks of page_size rows"""
+        selected = ", ".join(quote_identifier(col) for col in columns) if columns else "*"
+        where, params = self._where(filters)
+        limit = f" LIMIT {int(max_rows)}" if max_rows is not None else ""
+        with closing(self._connect(database)) as conn:
+            cursor = conn.execute(f"SELECT {selected} FROM {quote_identifier(table)}{where}{limit}", params)
+            names = [d[0] for d in cursor.description]
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    return
+                yield pd.DataFrame.from_records(rows, columns=names)
+
+    def count_rows(self, database: str, table: str, filters: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """Return the table's row count"""
+        try:
+            where, params = self._where(filters)
+            with closing(self._connect(database)) as conn:
+                return conn.execute(f"SELECT count(*) FROM {quote_identifier(table)}{where}", params).fetchone()[0]
+        except Exception:
+            return None
+
+    def get_table_rows(
+        self,
+        database: str,
+        table: str,
+        limit: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> pd.DataFrame:
+        """Fetch rows from a table, up to limit rows"""
+        try:
+            chunks = list(self.iter_table_rows(database, table, columns=columns, filters=filters, max_rows=limit))
+            return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        except Exception as e:
+            logger.error(f"Error fetching table rows: {e}")
+            return pd.DataFrame()
+
+
+class AsyncDatasetteUploader:
+    """
+    asyncio sibling of DatasetteUploader for running many writes at once.
+
+    All calls share one httpx.AsyncClient connection pool, and a single
+    semaphore caps the number of requests in flight across every job using
+    this client, so several uploads can run concurrently without
+    overwhelming the instance. Use it as an async context manager.
+    """
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str] = None,
+        batch_rows: int = DEFAULT_BATCH_ROWS,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        compression: Optional[str] = None,
+        metrics: Optional[UploadMetrics] = None,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.compression = compression
+        self.compression_checked = False
+        self.metrics = metrics
+        self.batch_rows = max(1, int(batch_rows))
+        self.batch_bytes = max(1, int(batch_bytes))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.retries = retries
+        self.backoff = backoff
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(DEFAULT_TIMEOUT[1], connect=DEFAULT_TIMEOUT[0]),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=httpx.AsyncHTTPTransport(retries=retries),  # connection failures only
+        )
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    async def __aenter__(self) -> "AsyncDatasetteUploader":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _post(self, url: str, body: bytes, encoding: Optional[str] = None, rows: int = 0) -> httpx.Response:
+        """
+        POST under the shared semaphore, backing off on 429/503 like
+        make_session(); other failures may have been applied, so they are
+        not resent. The final attempt is recorded in metrics, if set.
+        """
+        headers = {'Content-Type': 'application/json'}
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        call = url.rsplit('/-/', 1)[-1]
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                async with self.semaphore:
+                    response = await self.client.post(url, content=body, headers=headers)
+            except Exception as e:
+                if self.metrics:
+                    self.metrics.record(call, time.perf_counter() - started, bytes_sent=len(body), rows=rows,
+                                        retries=attempt, error=type(e).__name__)
+                raise
+            if response.status_code not in WRITE_RETRY_STATUSES or attempt == self.retries:
+                if self.metrics:
+                    self.metrics.record(
+                        call, time.perf_counter() - started,
+                        status=response.status_code,
+                        # httpx has read the whole response by now, so the
+                        # download is not split out of ttfb here
+                        server=server_timing(response.headers.get('Server-Timing')),
+                        bytes_sent=len(body),
+                        bytes_received=response.num_bytes_downloaded,
+                        rows=rows,
+                        retries=attempt,
+                    )
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.isdigit() else self.backoff * (2 ** attempt)
+            await asyncio.sleep(delay)
+        return response
+
+    async def _send_batch(self, url: str, start: int, end: int, body: bytes, raw: Optional[bytes] = None) -> Dict[str, Any]:
+        batch = {'start': start, 'end': end, 'rows': end - start, 'bytes': len(body), 'raw_bytes': len(raw or body)}
+        try:
+            encoding = self.compression if raw is not None and body is not raw else None
+            response = await self._post(url, body, encoding, rows=end - start)
+            batch['status_code'] = response.status_code
+            batch['success'] = response.status_code in [200, 201]
+            batch['response'] = response.text
+        except Exception as e:
+            batch['success'] = False
+            batch['error'] = str(e)
+        return batch
+
+    async def check_compression(self, url: str, endpoint: str) -> bool:
+        """Async counterpart of DatasetteUploader.check_compression"""
+        if not self.compression or self.compression_checked:
+            return bool(self.compression)
+        try:
+            response = await self.client.post(
+                url,
+                headers={'Content-Type': 'application/json', 'Content-Encoding': self.compression},
+                content=compress_body(b'{}', self.compression),
+            )
+            decoded = probe_decoded(response.status_code, response.json(), endpoint)
+        except Exception:
+            decoded = False
+        if decoded:
+            self.compression_checked = True
+        else:
+            self.compression = None
+        return decoded
+
+    async def _bulk_write(
+        self,
+        database: str,
+        table: str,
+        data: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        create: bool = False,
+        progress: Optional[ProgressCallback] = None,
+        endpoint: str = "insert",
+    ) -> Dict[str, Any]:
+        """Async counterpart of DatasetteUploader._bulk_write"""
+        create_url = f"{self.base_url}/{database}/-/create"
+        write_url = f"{self.base_url}/{database}/{table}/-/{endpoint}"
+        compression_refused = bool(self.compression) and not await self.check_compression(
+            create_url if create else write_url, 'create' if create else endpoint
+        )
+        if isinstance(data, pd.DataFrame):
+            chunks: Iterator[pd.DataFrame] = iter([data])
+            expected: Optional[int] = len(data)
+        else:
+            chunks, expected = iter(data), None
+        rows_read = done_rows = 0
+        batches: List[Dict[str, Any]] = []
+        started = time.perf_counter()
+
+        def record(batch: Dict[str, Any]):
+            nonlocal done_rows
+            batches.append(batch)
+            if batch.get('success'):
+                done_rows += batch['rows']
+            if progress:
+                progress(done_rows, expected, batch)
+
+        pending = set()
+        pending_create = create
+        while True:
+            # Parse the next chunk off the event loop so other jobs keep sending
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            offset = rows_read
+            rows_read += len(chunk)
+            skip = 0
+            if pending_create and len(chunk):
+                skip = min(self.batch_rows, len(chunk))
+                raw = encode_json_body(chunk.iloc[:skip], {"table": table})
+                record(await self._send_batch(create_url, offset, offset + skip, compress_body(raw, self.compression), raw))
+                if not batches[-1]['success']:
+                    break
+                pending_create = False
+            for start, end, wire, raw in iter_wire_batches(chunk.iloc[skip:], self.batch_rows, self.batch_bytes, compression=self.compression):
+                if len(pending) >= self.max_in_flight:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        record(task.result())
+                pending.add(asyncio.ensure_future(
+                    self._send_batch(write_url, offset + skip + start, offset + skip + end, wire, raw)
+                ))
+        for task in asyncio.as_completed(pending):
+            record(await task)
+
+        result = DatasetteUploader._summarize_batches(batches, rows_read, started)
+        if compression_refused:
+            result['warning'] = COMPRESSION_REFUSED
+        if create and not batches:
+            result.update(success=False, error="No rows to upload")
+        return result
+
+    async def create_table(
+        self,
+        database: str,
+        table_name: str,
+        df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """Create a new table with data from a DataFrame or DataFrame chunks"""
+        try:
+            return await self._bulk_write(database, table_name, df, create=True, progress=progress)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def insert_rows(
+        self,
+        database: str,
+        table: str,
+        df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """Insert rows from a DataFrame or DataFrame chunks into existing table"""
+        try:
+            return await self._bulk_write(database, table, df, progress=progress)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def _post_json(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = await self._post(url, dumps_json(payload))
+            return {
+                'success': response.status_code == 200,
+                'status_code': response.status_code,
+                'response': response.json() if response.headers.get("Content-Type", "").startswith("application/json") else response.text
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    async def update_rows(self, database: str, table: str, pk_values: List[str], updates: Dict[str, Any], return_row: bool = True) -> Dict[str, Any]:
+        """Update a row in a table by primary key(s)."""
+        row_pks = ",".join([urllib.parse.quote(pk, safe="") for pk in pk_values])
+        payload = {"update": updates}
+        if return_row:
+            payload["return"] = True
+        return await self._post_json(f"{self.base_url}/{database}/{table}/{row_pks}/-/update", payload)
+
+    async def delete_rows(self, database: str, table: str, row_pks: List[Any]) -> Dict[str, Any]:
+        """Delete a row by primary key(s); returns Datasette's response like DatasetteUploader.delete_rows"""
+        result = await self._post_json(f"{self.base_url}/{database}/{table}/{delete_pk_path(row_pks)}/-/delete", {})
+        if not result.get('success'):
+            return {"ok": False, "error": result.get('error', result.get('response'))}
+        return result['response']
+
+    async def drop_table(self, database: str, table: str, confirm: bool = False) -> Dict[str, Any]:
+        """Drop a table from the given database."""
+        return await self._post_json(f"{self.base_url}/{database}/{table}/-/drop", {"confirm": True} if confirm else {})
+
+
+async def run_upload_jobs_async(
+    uploader: AsyncDatasetteUploader,
+    jobs: List[Dict[str, Any]],
+    progress: Optional[Callable[[int, int, Optional[int], Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run upload jobs concurrently on one async client.
+
+    Each job is a dict with 'database', 'table', 'mode' ('create' or
+    'insert') and 'data' (a DataFrame or an iterable of chunks, e.g. from
+    iter_file_chunks). progress(job_index, rows_done, rows_total, batch)
+    is called as batches finish. Returns one result dict per job, in order.
+    """
+    async def run(index: int, job: Dict[str, Any]) -> Dict[str, Any]:
+        callback = (lambda done, total, batch: progress(index, done, total, batch)) if progress else None
+        write = uploader.create_table if job.get('mode') == 'create' else uploader.insert_rows
+        return await write(job['database'], job['table'], job['data'], progress=callback)
+
+    return await asyncio.gather(*(run(i, job) for i, job in enumerate(jobs)))
+
+def run_upload_jobs(
+    base_url: str,
+    token: Optional[str],
+    jobs: List[Dict[str, Any]],
+    progress: Optional[Callable[[int, int, Optional[int], Dict[str, Any]], None]] = None,
+    **client_options,
+) -> List[Dict[str, Any]]:
+    """Blocking wrapper around run_upload_jobs_async for synchronous callers"""
+    async def main() -> List[Dict[str, Any]]:
+        async with AsyncDatasetteUploader(base_url, token, **client_options) as uploader:
+            return await run_upload_jobs_async(uploader, jobs, progress)
+
+    return asyncio.run(main())
+
+
+# Background jobs: at most this many run at once against one instance
+DEFAULT_MAX_JOBS_PER_INSTANCE = 2
+DEFAULT_JOB_WORKERS = 8
+
+class JobCancelled(Exception):
+    pass
+
+class JobManager:
+    """
+    Runs long write operations on a thread pool, outside any Streamlit
+    script run, so they keep going when the user interacts with the page.
+
+    Each job gets an ID and a status record (queued, running, succeeded,
+    failed, cancelled) with row progress that the UI polls. Jobs wait in a
+    queue per instance and are only handed to the pool while fewer than
+    max_jobs_per_instance jobs for that instance are running, so a busy
+    instance never ties up the workers other instances' jobs need.
+
+    Jobs are tagged with the owner that submitted them (a browser session),
+    and jobs(), cancel() and clear_finished() only see that owner's jobs.
+    """
+    def __init__(self, max_workers: int = DEFAULT_JOB_WORKERS, max_jobs_per_instance: int = DEFAULT_MAX_JOBS_PER_INSTANCE):
+        self.max_jobs_per_instance = max_jobs_per_instance
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload-job")
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._cancel: Dict[str, threading.Event] = {}
+        self._work: Dict[str, Callable[[ProgressCallback], Dict[str, Any]]] = {}
+        self._queued: Dict[str, deque] = {}
+        self._running: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        instance: str,
+        description: str,
+        work: Callable[[ProgressCallback], Dict[str, Any]],
+        owner: Optional[str] = None,
+    ) -> str:
+        """
+        Queue work(progress) and return the job ID. work receives a
+        ProgressCallback and returns an uploader result dict.
+        """
+        job_id = uuid.uuid4().hex[:8]
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'owner': owner,
+                'instance': instance,
+                'description': description,
+                'status': 'queued',
+                'rows_done': 0,
+                'rows_total': None,
+                'submitted': time.time(),
+                'started': None,
+                'finished': None,
+                'result': None,
+                'error': None,
+            }
+            self._cancel[job_id] = threading.Event()
+            self._work[job_id] = work
+            self._queued.setdefault(instance, deque()).append(job_id)
+        self._dispatch(instance)
+        return job_id
+
+    def _dispatch(self, instance: str):
+        """Hand queued jobs for instance to the pool while it has free slots"""
+        with self._lock:
+            queue = self._queued.get(instance)
+            while queue and self._running.get(instance, 0) < self.max_jobs_per_instance:
+                job_id = queue.popleft()
+                work = self._work.pop(job_id)
+                self._running[instance] = self._running.get(instance, 0) + 1
+                self._pool.submit(self._run, job_id, instance, work)
+
+    def _update(self, job_id: str, **changes):
+        with self._lock:
+            self._jobs[job_id].update(changes)
+
+    def _run(self, job_id: str, instance: str, work: Callable[[ProgressCallback], Dict[str, Any]]):
+        try:
+            self._execute(job_id, work)
+        finally:
+            with self._lock:
+                self._running[instance] -= 1
+            self._dispatch(instance)
+
+    def _execute(self, job_id: str, work: Callable[[ProgressCallback], Dict[str, Any]]):
+        cancel = self._cancel[job_id]
+        if cancel.is_set():
+            self._update(job_id, status='cancelled', finished=time.time())
+            return
+        self._update(job_id, status='running', started=time.time())
+
+        def progress(done: int, total: Optional[int], batch: Dict[str, Any]):
+            if cancel.is_set():
+                raise JobCancelled("Job cancelled")
+            self._update(job_id, rows_done=done, rows_total=total)
+
+        try:
+            result = work(progress)
+            if cancel.is_set():
+                status = 'cancelled'
+            else:
+                status = 'succeeded' if result.get('success', result.get('ok')) else 'failed'
+            self._update(
+                job_id, status=status, result=result, finished=time.time(),
+                error=None if status == 'succeeded' else result.get('error', result.get('response')),
+            )
+        except Exception as e:
+            self._update(job_id, status='cancelled' if cancel.is_set() else 'failed', error=str(e), finished=time.time())
+
+    def cancel(self, job_id: str, owner: Optional[str] = None):
+        """
+        Ask one of owner's jobs to stop. A queued job is dropped from the
+        queue; a running one stops at its next batch boundary.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['owner'] != owner:
+                return
+            self._cancel[job_id].set()
+            queue = self._queued.get(job['instance'])
+            if job_id in self._work and queue is not None:
+                queue.remove(job_id)
+                del self._work[job_id]
+                job.update(status='cancelled', finished=time.time())
+
+    def jobs(self, owner: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Snapshot of owner's jobs, newest first"""
+        with self._lock:
+            return [dict(job) for job in reversed(self._jobs.values()) if job['owner'] == owner]
+
+    def clear_finished(self, owner: Optional[str] = None):
+        with self._lock:
+            for job_id in [
+                j for j, job in self._jobs.items()
+                if job['owner'] == owner and job['status'] not in ('queued', 'running')
+            ]:
+                del self._jobs[job_id]
+                del self._cancel[job_id]
+
+
+# Either backend; both expose the same methods and result dicts
+Uploader = Union[DatasetteUploader, LocalSQLiteUploader]
+
+# Upload checkpoints live in the user's home directory unless configured
+# otherwise; the installed package directory may not be writable
+DEFAULT_JOURNAL_PATH = os.environ.get(
+    "DATA_UPLOADER_JOURNAL", os.path.join(os.path.expanduser("~"), ".data-uploader", "upload_journal.db")
+)
+
+def file_fingerprint(uploaded_file, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of an upload's name and content, read in blocks"""
+    digest = hashlib.sha256(uploaded_file.name.encode('utf-8'))
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(block_size), b''):
+        digest.update(block)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+def skip_rows(chunks: Iterable[pd.DataFrame], rows: int) -> Iterator[pd.DataFrame]:
+    """Drop the first rows rows from a stream of chunks"""
+    for chunk in chunks:
+        if rows >= len(chunk):
+            rows -= len(chunk)
+            continue
+        yield chunk.iloc[rows:] if rows else chunk
+        rows = 0
+
+# A 'running' journal entry that hasn't advanced for this long is taken to
+# belong to a process that died, and may be resumed
+JOURNAL_STALE_AFTER = 15 * 60  # seconds
+
+class UploadJournal:
+    """
+    Small SQLite journal of in-progress uploads.
+
+    Each upload is identified by (file fingerprint, instance, database,
+    table) and records how many leading rows of the file are known to be
+    committed. Batches can finish out of order, so the checkpoint only
+    advances over a contiguous run of successful batches.
+
+    An entry is claimed by start() while its upload runs, so the same file
+    is never uploaded to the same table twice at once.
+    """
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    id INTEGER PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    instance TEXT NOT NULL,
+                    database_name TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    committed_rows INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _unfinished(self, conn: sqlite3.Connection, fingerprint: str, instance: str, database: str, table: str) -> List[sqlite3.Row]:
+        return conn.execute(
+            "SELECT * FROM uploads WHERE fingerprint = ? AND instance = ? AND database_name = ? "
+            "AND table_name = ? AND status != 'complete' ORDER BY id DESC",
+            (fingerprint, instance, database, table),
+        ).fetchall()
+
+    @staticmethod
+    def _live(entry, now: float) -> bool:
+        return entry['status'] == 'running' and now - entry['updated'] < JOURNAL_STALE_AFTER
+
+    def find(self, fingerprint: str, instance: str, database: str, table: str) -> Optional[Dict[str, Any]]:
+        """The unfinished upload of this file to this table that can be resumed, if any"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            rows = self._unfinished(conn, fingerprint, instance, database, table)
+        if not rows or any(self._live(row, now) for row in rows):
+            return None
+        return dict(rows[0])
+
+    def is_running(self, fingerprint: str, instance: str, database: str, table: str) -> bool:
+        """Whether this file is being uploaded to this table right now"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            return any(self._live(row, now) for row in self._unfinished(conn, fingerprint, instance, database, table))
+
+    def start(self, fingerprint: str, instance: str, database: str, table: str, mode: str) -> Optional[Dict[str, Any]]:
+        """
+        Claim the unfinished entry to resume, or record a new one. Returns
+        None when another upload of this file to this table is running.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # IMMEDIATE takes the write lock up front, so two uploads can't both claim the entry
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._unfinished(conn, fingerprint, instance, database, table)
+                if any(self._live(row, now) for row in rows):
+                    conn.execute("ROLLBACK")
+                    return None
+                if rows:
+                    upload_id = rows[0]['id']
+                    conn.execute("UPDATE uploads SET status = 'running', updated = ? WHERE id = ?", (now, upload_id))
+                else:
+                    upload_id = conn.execute(
+                        "INSERT INTO uploads (fingerprint, instance, database_name, table_name, mode, status, created, updated) "
+                        "VALUES (?, ?, ?, ?, ?, 'running', ?, ?)",
+                        (fingerprint, instance, database, table, mode, now, now),
+                    ).lastrowid
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(upload_id)
+
+    def get(self, upload_id: int) -> Dict[str, Any]:
+        with closing(self._connect()) as conn:
+            return dict(conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone())
+
+    def checkpoint(self, upload_id: int, committed_rows: int):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE uploads SET committed_rows = ?, status = 'running', updated = ? WHERE id = ?",
+                (committed_rows, time.time(), upload_id),
+            )
+
+    def finish(self, upload_id: int, success: bool, error: Optional[str] = None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE uploads SET status = ?, error = ?, updated = ? WHERE id = ?",
+                ('complete' if success else 'failed', error, time.time(), upload_id),
+            )
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute("SELECT * FROM uploads WHERE status != 'complete' ORDER BY updated DESC")]
+
+    def discard(self, upload_id: int):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+
+def checkpointed_upload(
+    uploader: Uploader,
+    journal: UploadJournal,
+    fingerprint: str,
+    instance: str,
+    database: str,
+    table: str,
+    mode: str,
+    chunks: Iterable[pd.DataFrame],
+    progress: Optional[ProgressCallback] = None,
+    pk: Optional[Union[str, List[str]]] = None,
+    columns: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Create or insert with a journal checkpoint, resuming a previous
+    attempt at the same file and table from its first unconfirmed row.
+
+    A resumed upload always inserts (the table already exists) with
+    replace semantics, so batches that landed after the checkpoint but
+    before the failure overwrite themselves rather than duplicating. That
+    needs a primary key; rowid tables may get those rows twice.
+    """
+    entry = journal.start(fingerprint, instance, database, table, mode)
+    if entry is None:
+        return {'success': False, 'error': f"This file is already being uploaded to '{table}'"}
+    resume_from = entry['committed_rows']
+    resuming = resume_from > 0
+    committed = 0  # rows committed in this attempt, contiguous from its first row
+    finished: Dict[int, int] = {}
+
+    def track(done: int, total: Optional[int], batch: Dict[str, Any]):
+        nonlocal committed
+        if batch.get('success'):
+            finished[batch['start']] = batch['end']
+            advanced = committed
+            while advanced in finished:
+                advanced = finished.pop(advanced)
+            if advanced != committed:
+                committed = advanced
+                journal.checkpoint(entry['id'], resume_from + committed)
+        if progress:
+            progress(resume_from + done, None if total is None else resume_from + total, batch)
+
+    rows = skip_rows(chunks, resume_from)
+    if mode == 'create' and not resuming:
+        result = uploader.create_table(database, table, rows, progress=track, pk=pk, columns=columns)
+    else:
+        if columns:
+            rows = (coerce_to_schema(chunk, columns) for chunk in rows)
+        result = uploader.insert_rows(database, table, rows, progress=track, replace=resuming)
+    journal.finish(entry['id'], bool(result.get('success')), result.get('error'))
+    result['resumed_from'] = resume_from
+    return result
+
+
+NUMERIC_AFFINITY = ('INT', 'REAL', 'FLOA', 'DOUB', 'NUM', 'DEC')
+# Stands in for NULL when hashing; cannot come out of a CSV cell or JSON string
+HASH_NULL = '\x00'
+
+def round_significant(values: np.ndarray, digits: int = 15) -> np.ndarray:
+    """
+    Round floats to digits significant digits, so a value that went through
+    a text file and one read back from SQLite compare equal even when the
+    parser was off by an ulp
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(values)))
+    scale = 10.0 ** np.clip(digits - 1 - np.nan_to_num(magnitude, nan=0, posinf=0, neginf=0), -300, 300)
+    return np.round(values * scale) / scale
+
+def canonical_text(series: pd.Series, declared: Optional[str] = None) -> pd.Series:
+    """
+    Render a column as strings that compare equal whether the values came
+    from a parsed file or back from the database: numbers (and numeric
+    affinity columns) go through float, datetimes use the upload ISO form,
+    NULL becomes HASH_NULL.
+    """
+    declared = (declared or '').upper()
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = pd.Series(_column_values(series), index=series.index, dtype=object)
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series) or any(t in declared for t in NUMERIC_AFFINITY):
+        numbers = pd.to_numeric(series, errors='coerce').astype('float64')
+        text = pd.Series(round_significant(numbers.to_numpy()), index=series.index).astype(str)
+        text = text.where(numbers.notna(), series.astype(str))
+    else:
+        text = series.astype(str)
+    return text.where(series.notna(), HASH_NULL)
+
+def row_hashes(
+    df: pd.DataFrame,
+    pk_cols: List[str],
+    value_cols: List[str],
+    column_types: Dict[str, str],
+) -> Tuple[pd.Index, np.ndarray]:
+    """Return (key per row, 64-bit hash of value_cols per row), computed column-wise"""
+    keys = [canonical_text(df[pk], column_types.get(pk)) for pk in pk_cols]
+    key = keys[0] if len(keys) == 1 else keys[0].str.cat(keys[1:], sep='\x1f')
+    values = pd.DataFrame({
+        col: canonical_text(df[col], column_types.get(col)) if col in df else HASH_NULL
+        for col in value_cols
+    }, index=df.index)
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy() if value_cols else np.zeros(len(df), dtype=np.uint64)
+    return pd.Index(key.to_numpy()), hashes
+
+def compute_sync_diff(
+    uploader: Uploader,
+    database: str,
+    table: str,
+    df: pd.DataFrame,
+    pk_cols: List[str],
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Work out which rows of df differ from the table.
+
+    The table is streamed page by page with only pk_cols and df's columns
+    requested; each page is reduced to a key and a content hash, so memory
+    holds hashes rather than the table. Rows whose key is not in the table
+    are inserts, rows whose hash differs are updates, and table keys absent
+    from df are deletes. Later rows win for duplicate keys in df.
+    """
+    started = time.perf_counter()
+    column_types = uploader.get_column_types(database, table)
+    # Only columns the file and the table share take part in the comparison
+    value_cols = [col for col in df.columns if col not in pk_cols and (not column_types or col in column_types)]
+
+    table_keys, table_hashes, table_pks = [], [], []
+    scanned = 0
+    for page in uploader.iter_table_rows(database, table, columns=[*pk_cols, *value_cols], prefetch=True):
+        if page.empty:
+            continue
+        keys, hashes = row_hashes(page, pk_cols, value_cols, column_types)
+        table_keys.append(keys)
+        table_hashes.append(hashes)
+        table_pks.append(page[pk_cols])
+        scanned += len(page)
+        if progress:
+            progress(scanned, None, {'rows': len(page)})
+    existing = pd.Series(
+        np.concatenate(table_hashes) if table_hashes else np.array([], dtype=np.uint64),
+        index=table_keys[0].append(table_keys[1:]) if table_keys else pd.Index([], dtype=object),
+    )
+
+    incoming_keys, incoming_hashes = row_hashes(df, pk_cols, value_cols, column_types)
+    last = ~incoming_keys.duplicated(keep='last')
+    df, incoming_keys, incoming_hashes = df[last], incoming_keys[last], incoming_hashes[last]
+    present = incoming_keys.isin(existing.index)
+    changed = np.zeros(len(df), dtype=bool)
+    changed[present] = existing.reindex(incoming_keys[present]).to_numpy() != incoming_hashes[present]
+    missing = ~existing.index.isin(incoming_keys)
+    deletes = pd.concat(table_pks, ignore_index=True)[missing] if table_pks else pd.DataFrame(columns=pk_cols)
+
+    return {
+        'inserts': df[~present].reset_index(drop=True),
+        'updates': df[changed].reset_index(drop=True),
+        'deletes': deletes,
+        'unchanged': int(present.sum() - changed.sum()),
+        'duplicate_keys': int((~last).sum()),
+        'rows_scanned': scanned,
+        'elapsed': time.perf_counter() - started,
+    }
+
+def apply_sync_diff(
+    uploader: Uploader,
+    database: str,
+    table: str,
+    diff: Dict[str, Any],
+    pk_cols: List[str],
+    delete_missing: bool = False,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Send a diff from compute_sync_diff: inserts as batches, updates row by
+    row on their keys and, if delete_missing, deletes of table rows that
+    are not in the file. Stops at the first step that fails.
+    """
+    started = time.perf_counter()
+    steps: Dict[str, Dict[str, Any]] = {}
+    if len(diff['inserts']):
+        steps['insert'] = uploader.insert_rows(database, table, diff['inserts'], progress=progress)
+    if len(diff['updates']) and all(step.get('success') for step in steps.values()):
+        steps['update'] = uploader.bulk_update(database, table, diff['updates'], pk_cols, progress=progress)
+    if delete_missing and len(diff['deletes']) and all(step.get('success') for step in steps.values()):
+        steps['delete'] = uploader.bulk_delete(database, table, diff['deletes'], pk_cols, progress=progress)
+
+    failed = [name for name, step in steps.items() if not step.get('success')]
+    result = {
+        'success': not failed,
+        'rows_inserted': steps.get('insert', {}).get('rows_written', 0),
+        'rows_updated': steps.get('update', {}).get('rows_updated', 0),
+        'rows_deleted': steps.get('delete', {}).get('rows_deleted', 0),
+        'elapsed': time.perf_counter() - started,
+        'steps': steps,
+    }
+    if failed:
+        result['error'] = f"{failed[0].capitalize()} step failed: {steps[failed[0]].get('error', 'Unknown error')}"
+    return result
+
+
+# Problem rows kept for display in a validation report
+DEFAULT_MAX_ISSUES = 1000
+VALIDATION_ACTIONS = {
+    'stop': "Don't upload until the file is fixed",
+    'skip': "Skip rows with problems",
+    'null': "Set values of the wrong type to NULL, skip other bad rows",
+}
+
+def type_violations(series: pd.Series, declared: Optional[str]) -> pd.Series:
+    """Mask of non-null values that do not fit the column's declared numeric type"""
+    declared = (declared or '').upper()
+    if 'INT' in declared:
+        numbers = pd.to_numeric(series, errors='coerce')
+        return series.notna() & (numbers.isna() | (numbers % 1 != 0))
+    if any(t in declared for t in NUMERIC_AFFINITY):
+        return series.notna() & pd.to_numeric(series, errors='coerce').isna()
+    return pd.Series(False, index=series.index)
+
+def validate_rows(
+    chunks: Iterable[pd.DataFrame],
+    table_columns: List[Dict[str, Any]],
+    pk_cols: Optional[List[str]] = None,
+    max_issues: int = DEFAULT_MAX_ISSUES,
+) -> Dict[str, Any]:
+    """
+    Check an upload against a table's columns (from get_table_columns)
+    without sending anything. Each chunk is checked column-wise for values
+    of the wrong type, NULLs in NOT NULL or key columns, and keys that
+    repeat within the file; keys are compared across chunks by hash.
+
+    Returns unknown/missing column lists, per-problem counts, up to
+    max_issues example rows in 'issues', and the row numbers to drop for
+    each action in 'bad_rows' ('skip') and 'unfixable_rows' ('null').
+    """
+    types = {col['name']: col['type'] for col in table_columns}
+    not_null = {col['name'] for col in table_columns if col.get('notnull')}
+    required = set(pk_cols or [])
+    if pk_cols is None:
+        pk_cols = [col['name'] for col in sorted(table_columns, key=lambda col: col.get('pk') or 0) if col.get('pk')]
+        # A NULL INTEGER PRIMARY KEY is allowed on insert: SQLite assigns the next rowid
+        if not (len(pk_cols) == 1 and (types.get(pk_cols[0]) or '').upper() == 'INTEGER'):
+            required = set(pk_cols)
+    unknown: List[str] = []
+    seen_columns: List[str] = []
+    wrong_type_columns: List[str] = []
+    issues: List[pd.DataFrame] = []
+    counts: Dict[str, int] = {}
+    bad_rows: List[np.ndarray] = []
+    unfixable_rows: List[np.ndarray] = []
+    key_rows: List[np.ndarray] = []
+    key_hashes: List[np.ndarray] = []
+    rows = 0
+
+    def record(problem: str, column: str, mask: pd.Series, chunk: pd.DataFrame, offset: int):
+        positions = np.flatnonzero(mask.to_numpy())
+        if not len(positions):
+            return
+        counts[problem] = counts.get(problem, 0) + len(positions)
+        if sum(len(i) for i in issues) < max_issues:
+            issues.append(pd.DataFrame({
+                'row': positions + offset,
+                'column': column,
+                'problem': problem,
+                'value': chunk[column].iloc[positions].astype(str).to_numpy() if column in chunk else None,
+            }))
+
+    for chunk in chunks:
+        offset = rows
+        rows += len(chunk)
+        if not seen_columns:
+            seen_columns = list(chunk.columns)
+            unknown = [col for col in seen_columns if types and col not in types]
+        bad = pd.Series(False, index=chunk.index)
+        unfixable = pd.Series(False, index=chunk.index)
+        for col in chunk.columns:
+            if col not in types:
+                continue
+            wrong = type_violations(chunk[col], types[col])
+            record("wrong type", col, wrong, chunk, offset)
+            if wrong.any() and col not in wrong_type_columns:
+                wrong_type_columns.append(col)
+            bad |= wrong
+            if col in not_null or col in pk_cols:
+                # Nulling the value would break the constraint, so the row has to go
+                unfixable |= wrong
+        for col in sorted((not_null | required) & set(types)):
+            empty = chunk[col].isna() if col in chunk else pd.Series(True, index=chunk.index)
+            record("missing key" if col in required else "null in NOT NULL column", col, empty, chunk, offset)
+            bad |= empty
+            unfixable |= empty
+        if pk_cols and all(col in chunk for col in pk_cols):
+            complete = chunk[pk_cols].notna().all(axis=1).to_numpy()
+            key_rows.append(np.flatnonzero(complete) + offset)
+            key_hashes.append(pd.util.hash_pandas_object(chunk.loc[complete, pk_cols], index=False).to_numpy())
+        bad_rows.append(np.flatnonzero(bad.to_numpy()) + offset)
+        unfixable_rows.append(np.flatnonzero(unfixable.to_numpy()) + offset)
+
+    if key_hashes:
+        # Later occurrences of a key are the problem; the first one is kept
+        duplicate = pd.Series(np.concatenate(key_hashes)).duplicated().to_numpy()
+        positions = np.concatenate(key_rows)[duplicate]
+        if len(positions):
+            counts["duplicate key"] = len(positions)
+            if sum(len(i) for i in issues) < max_issues:
+                issues.append(pd.DataFrame({'row': positions, 'column': ", ".join(pk_cols), 'problem': "duplicate key", 'value': None}))
+            bad_rows.append(positions)
+            unfixable_rows.append(positions)
+
+    def merge(parts: List[np.ndarray]) -> np.ndarray:
+        return np.unique(np.concatenate(parts)) if parts else np.array([], dtype=np.int64)
+
+    report = pd.concat(issues, ignore_index=True).head(max_issues) if issues else pd.DataFrame(columns=['row', 'column', 'problem', 'value'])
+    bad = merge(bad_rows)
+    return {
+        'valid': not unknown and not len(bad),
+        'rows': rows,
+        'unknown_columns': unknown,
+        'missing_columns': [col for col in types if seen_columns and col not in seen_columns],
+        'counts': counts,
+        'issues': report.sort_values('row', kind='stable').reset_index(drop=True),
+        'bad_rows': bad,
+        'unfixable_rows': merge(unfixable_rows),
+        'column_types': types,
+        'wrong_type_columns': wrong_type_columns,
+    }
+
+def readable_column_types(column_types: Dict[str, str], report: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """
+    The part of column_types that is safe to pass to iter_file_chunks as
+    read hints. Text hints never fail, but a numeric hint makes the parse
+    raise on the first value that isn't a number, before validate_rows can
+    report it. Numeric types are therefore dropped, except for columns that a
+    validate_rows report found no wrong-type values in.
+    """
+    if report is not None:
+        return {name: declared for name, declared in column_types.items() if name not in report['wrong_type_columns']}
+    hints = dtype_hints(column_types)
+    return {name: declared for name, declared in column_types.items() if hints.get(name, str) is str}
+
+def apply_validation(chunks: Iterable[pd.DataFrame], report: Dict[str, Any], action: str) -> Iterator[pd.DataFrame]:
+    """
+    Clean chunks according to a validate_rows report: unknown columns are
+    dropped and, with action 'skip', every flagged row too; with 'null'
+    wrongly typed values become NULL and only rows that stay invalid are
+    dropped. Rows are numbered as in the report, so chunks must come from
+    the same file in the same order.
+    """
+    drop = report['bad_rows'] if action == 'skip' else report['unfixable_rows']
+    rows = 0
+    for chunk in chunks:
+        offset = rows
+        rows += len(chunk)
+        chunk = chunk.drop(columns=[col for col in report['unknown_columns'] if col in chunk])
+        if action == 'null':
+            for col in chunk.columns:
+                wrong = type_violations(chunk[col], report['column_types'].get(col))
+                if wrong.any():
+                    chunk[col] = chunk[col].astype(object).where(~wrong, None)
+        local = drop[(drop >= offset) & (drop < rows)] - offset
+        if len(local):
+            keep = np.ones(len(chunk), dtype=bool)
+            keep[local] = False
+            chunk = chunk[keep]
+        yield chunk
+
+
+# Upload formats by extension. Parquet, Arrow IPC/Feather and JSON Lines
+# are read with pyarrow (only imported when such a file is opened)
+FILE_EXTENSIONS = {
+    'csv': ('.csv',),
+    'excel': ('.xlsx', '.xls'),
+    'parquet': ('.parquet', '.pq'),
+    'arrow': ('.arrow', '.feather', '.ipc'),
+    'jsonl': ('.jsonl', '.ndjson'),
+}
+UPLOAD_TYPES = [ext.lstrip('.') for extensions in FILE_EXTENSIONS.values() for ext in extensions]
+ARROW_KINDS = ('parquet', 'arrow', 'jsonl')
+UNSUPPORTED_FORMAT = "Unsupported file format. Please upload CSV, Excel, Parquet, Arrow/Feather or JSON Lines files."
+
+def load_file(uploaded_file, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    """Load data from uploaded file, optionally only the given columns"""
+    try:
+        kind = file_kind(uploaded_file.name)
+        if kind == 'csv':
+            df = pd.read_csv(uploaded_file, usecols=columns)
+        elif kind == 'excel':
+            df = pd.read_excel(uploaded_file, usecols=columns)
+        elif kind in ARROW_KINDS:
+            chunks = list(iter_file_chunks(uploaded_file, columns=columns))
+            df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+        else:
+            logger.error(UNSUPPORTED_FORMAT)
+            return None
+        
+        return df
+    except Exception as e:
+        logger.error(f"Error loading file: {e}")
+        return None
+
+def file_kind(name: str) -> Optional[str]:
+    """Classify an upload by extension: a FILE_EXTENSIONS key or None"""
+    name = name.lower()
+    for kind, extensions in FILE_EXTENSIONS.items():
+        if name.endswith(extensions):
+            return kind
+    return None
+
+def dtype_hints(column_types: Dict[str, str], engine: str = 'pandas') -> Dict[str, Any]:
+    """
+    Translate SQLite declared types into read dtypes so columns are parsed
+    as the target table stores them (e.g. TEXT keeps leading zeros, INTEGER
+    columns with gaps stay integers instead of becoming floats).
+    """
+    hints = {}
+    for name, declared in column_types.items():
+        declared = (declared or '').upper()
+        if any(t in declared for t in ('CHAR', 'CLOB', 'TEXT')):
+            hints[name] = 'string' if engine == 'pyarrow' else str
+        elif engine == 'pyarrow':
+            # Arrow's numeric inference is already null-aware and its casts
+            # reject values like "1.0" for int64, so only text is pinned
+            continue
+        elif 'INT' in declared:
+            hints[name] = 'Int64'
+        elif any(t in declared for t in ('REAL', 'FLOA', 'DOUB')):
+            hints[name] = 'Float64'
+    return hints
+
+def preview_file(uploaded_file, nrows: int = DEFAULT_PREVIEW_ROWS, as_text: bool = False) -> Optional[pd.DataFrame]:
+    """
+    Parse only the first nrows rows of an upload, for display. With
+    as_text CSV cells are kept as strings (for schema inference).
+    """
+    try:
+        kind = file_kind(uploaded_file.name)
+        uploaded_file.seek(0)
+        if kind == 'csv':
+            return pd.read_csv(uploaded_file, nrows=nrows, dtype=str if as_text else None)
+        if kind == 'excel':
+            return next(_iter_excel_chunks(uploaded_file, nrows), pd.DataFrame())
+        if kind in ARROW_KINDS:
+            # Typed formats have no leading zeros to lose, so as_text does not apply
+            return next(iter_file_chunks(uploaded_file, nrows), pd.DataFrame())
+        logger.error(UNSUPPORTED_FORMAT)
+        return None
+    except Exception as e:
+        logger.error(f"Error loading file: {e}")
+        return None
+    finally:
+        uploaded_file.seek(0)
+
+def iter_file_chunks(
+    uploaded_file,
+    chunksize: int = DEFAULT_CHUNK_ROWS,
+    engine: str = 'pandas',
+    column_types: Optional[Dict[str, str]] = None,
+    kind: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield an upload as DataFrames of at most chunksize rows, so peak memory
+    is bounded by the chunk size rather than the file size.
+
+    - engine: 'pandas' (C parser) or 'pyarrow' (multithreaded streaming CSV reader)
+    - column_types: target table's SQLite types, used as dtype hints
+    - kind: a FILE_EXTENSIONS key when the name has no extension (e.g. a
+      pipe); CSV is read straight through, so the source need not be seekable
+    - columns: only read these columns; the others are never materialized
+
+    Parquet, Arrow and JSON Lines files are streamed record batch by record
+    batch with pyarrow and only each chunk is converted to pandas.
+    """
+    hints = dtype_hints(column_types or {}, engine)
+    kind = kind or file_kind(uploaded_file.name)
+    if uploaded_file.seekable():
+        uploaded_file.seek(0)
+    if kind == 'csv' and engine == 'pyarrow':
+        yield from _iter_arrow_csv_chunks(uploaded_file, chunksize, hints, columns)
+    elif kind == 'csv':
+        with pd.read_csv(uploaded_file, chunksize=chunksize, dtype=hints or None, usecols=columns) as reader:
+            yield from reader
+    elif kind == 'excel':
+        for chunk in _iter_excel_chunks(uploaded_file, chunksize, hints):
+            yield chunk[columns] if columns else chunk
+    elif kind == 'parquet':
+        yield from _iter_parquet_chunks(uploaded_file, chunksize, columns)
+    elif kind == 'arrow':
+        yield from _iter_ipc_chunks(uploaded_file, chunksize, columns)
+    elif kind == 'jsonl':
+        yield from _iter_jsonl_chunks(uploaded_file, chunksize, columns)
+    else:
+        raise ValueError(UNSUPPORTED_FORMAT)
+
+def _arrow_source(uploaded_file):
+    """
+    The upload as a pyarrow input without copying it: a memory map of a
+    file on disk, a view of an in-memory upload, or (for pipes) the bytes
+    read so far.
+    """
+    import pyarrow as pa
+
+    try:
+        uploaded_file.fileno()
+        if os.path.isfile(uploaded_file.name):
+            return pa.memory_map(uploaded_file.name)
+    except (AttributeError, OSError):
+        pass
+    if hasattr(uploaded_file, 'getbuffer'):
+        return pa.BufferReader(pa.py_buffer(uploaded_file.getbuffer()))
+    return pa.BufferReader(pa.py_buffer(uploaded_file.read()))
+
+def _arrow_chunks(batches: Iterable[Any], chunksize: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Regroup pyarrow record batches into DataFrames of at most chunksize rows"""
+    import pyarrow as pa
+
+    # Keep integer columns with nulls as nullable integers rather than floats
+    types_mapper = {pa.int64(): pd.Int64Dtype()}.get
+    buffered, buffered_rows = [], 0
+    for batch in batches:
+        if columns:
+            batch = batch.select(columns)
+        while batch.num_rows:
+            take = min(chunksize - buffered_rows, batch.num_rows)
+            buffered.append(batch.slice(0, take))
+            buffered_rows += take
+            batch = batch.slice(take)
+            if buffered_rows >= chunksize:
+                yield pa.Table.from_batches(buffered).to_pandas(types_mapper=types_mapper)
+                buffered, buffered_rows = [], 0
+    if buffered:
+        yield pa.Table.from_batches(buffered).to_pandas(types_mapper=types_mapper)
+
+def _iter_arrow_csv_chunks(
+    uploaded_file, chunksize: int, hints: Dict[str, str], columns: Optional[List[str]] = None
+) -> Iterator[pd.DataFrame]:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    reader = pa_csv.open_csv(
+        uploaded_file,
+        convert_options=pa_csv.ConvertOptions(
+            column_types={k: pa.type_for_alias(v) for k, v in hints.items()},
+            include_columns=columns or [],
+        ),
+    )
+    yield from _arrow_chunks(reader, chunksize)
+
+def _iter_parquet_chunks(uploaded_file, chunksize: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Read a Parquet file row group by row group, decoding only the requested columns"""
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(_arrow_source(uploaded_file))
+    yield from _arrow_chunks(parquet.iter_batches(batch_size=chunksize, columns=columns), chunksize)
+
+def _iter_ipc_chunks(uploaded_file, chunksize: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Read an Arrow IPC file (Feather v2) or stream; a memory-mapped file is not copied"""
+    import pyarrow as pa
+
+    source = _arrow_source(uploaded_file)
+    try:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        batches = pa.ipc.open_stream(source)
+    yield from _arrow_chunks(batches, chunksize, columns)
+
+def _iter_jsonl_chunks(uploaded_file, chunksize: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Read newline-delimited JSON with pyarrow's streaming reader, or pandas' on older pyarrow"""
+    import pyarrow.json as pa_json
+
+    if hasattr(pa_json, 'open_json'):
+        yield from _arrow_chunks(pa_json.open_json(_arrow_source(uploaded_file)), chunksize, columns)
+        return
+    with pd.read_json(uploaded_file, lines=True, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk[columns] if columns else chunk
+
+def _iter_excel_chunks(uploaded_file, chunksize: int, hints: Optional[Dict[str, Any]] = None) -> Iterator[pd.DataFrame]:
+    """Stream the first sheet of a workbook row by row in openpyxl read-only mode"""
+    def typed(df: pd.DataFrame) -> pd.DataFrame:
+        for col, dtype in (hints or {}).items():
+            if col in df:
+                try:
+                    # astype(str) would turn blank cells into "None"; keep them null as read_csv does
+                    df[col] = df[col].astype(dtype).where(df[col].notna(), None)
+                except (TypeError, ValueError):
+                    pass
+        return df
+
+    if uploaded_file.name.lower().endswith('.xls'):
+        # Legacy .xls has no streaming reader; parse it whole and slice
+        df = typed(pd.read_excel(uploaded_file))
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        buffered = []
+        for row in rows:
+            buffered.append(row)
+            if len(buffered) >= chunksize:
+                yield typed(pd.DataFrame.from_records(buffered, columns=columns))
+                buffered = []
+        if buffered:
+            yield typed(pd.DataFrame.from_records(buffered, columns=columns))
+    finally:
+        workbook.close()
+
+# Parsed uploads kept across reruns: in memory up to the first budget,
+# then (when a spill directory is set) as Arrow files up to the second
+DEFAULT_PARSE_CACHE_BYTES = 1024 ** 3
+DEFAULT_SPILL_BYTES = 4 * 1024 ** 3
+DEFAULT_SPILL_DIR = os.path.join(tempfile.gettempdir(), "data-uploader-cache")
+MAX_REMEMBERED_DIGESTS = 1024
+
+class ParsedFileCache:
+    """
+    Thread-safe LRU cache of parsed uploads, so a file is parsed once and
+    not on every Streamlit rerun.
+
+    Entries are keyed by the upload's content hash plus how it was parsed
+    (e.g. ('load',) or ('preview', nrows, as_text)), so the same file
+    uploaded twice is only parsed once. Frames are bounded by their
+    in-memory size; the least recently used are dropped, or written to an
+    Arrow file under spill_dir and memory-mapped back on the next hit.
+    Cached frames are shared, so callers must not modify them in place.
+    """
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_PARSE_CACHE_BYTES,
+        spill_dir: Optional[str] = None,
+        max_spill_bytes: int = DEFAULT_SPILL_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self._memory: OrderedDict = OrderedDict()  # key -> (frame, bytes)
+        self._disk: OrderedDict = OrderedDict()  # key -> (path, bytes)
+        # Content hashes by Streamlit file_id, so a rerun does not rehash the upload
+        self._digests: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.evictions = 0
+
+    def digest(self, uploaded_file) -> str:
+        file_id = getattr(uploaded_file, 'file_id', None)
+        with self._lock:
+            if file_id is not None and file_id in self._digests:
+                self._digests.move_to_end(file_id)
+                return self._digests[file_id]
+        digest = file_fingerprint(uploaded_file)
+        if file_id is not None:
+            with self._lock:
+                self._digests[file_id] = digest
+                while len(self._digests) > MAX_REMEMBERED_DIGESTS:
+                    self._digests.popitem(last=False)
+        return digest
+
+    def get_or_parse(
+        self,
+        uploaded_file,
+        options: Tuple,
+        parse: Callable[[], Optional[pd.DataFrame]],
+    ) -> Optional[pd.DataFrame]:
+        """The cached frame for this upload and options, or parse() it and cache the result (None is not cached)"""
+        key = (self.digest(uploaded_file), *options)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key][0]
+            spilled = self._disk.pop(key, None)
+        if spilled is not None:
+            df = self._read_spill(spilled[0])
+            if df is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._store(key, df)
+                return df
+        with self._lock:
+            self.misses += 1
+        df = parse()
+        if df is not None:
+            self._store(key, df)
+        return df
+
+    def _store(self, key: Tuple, df: pd.DataFrame):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        evicted = []
+        with self._lock:
+            self._memory[key] = (df, size)
+            self._memory.move_to_end(key)
+            used = sum(entry[1] for entry in self._memory.values())
+            while used > self.max_bytes and self._memory:
+                old_key, (old_df, old_size) = self._memory.popitem(last=False)
+                used -= old_size
+                evicted.append((old_key, old_df))
+        for old_key, old_df in evicted:
+            self._spill(old_key, old_df)
+
+    def _spill(self, key: Tuple, df: pd.DataFrame):
+        """Write an evicted frame to an Arrow file, or just drop it without a spill directory"""
+        with self._lock:
+            self.evictions += 1
+        if not self.spill_dir:
+            return
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        path = os.path.join(self.spill_dir, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + '.arrow')
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            feather.write_feather(df, path, compression='uncompressed')
+        except (pa.ArrowException, OSError, TypeError, ValueError) as e:
+            # e.g. object columns mixing strings and numbers have no Arrow type
+            logger.debug(f"Not spilling parsed file: {e}")
+            return
+        removed = []
+        with self._lock:
+            self._disk[key] = (path, os.path.getsize(path))
+            self.spills += 1
+            used = sum(entry[1] for entry in self._disk.values())
+            while used > self.max_spill_bytes and self._disk:
+                _, (old_path, old_size) = self._disk.popitem(last=False)
+                used -= old_size
+                removed.append(old_path)
+        for old_path in removed:
+            self._remove(old_path)
+
+    def _read_spill(self, path: str) -> Optional[pd.DataFrame]:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        try:
+            df = feather.read_table(path, memory_map=True).to_pandas()
+        except (pa.ArrowException, OSError):
+            df = None
+        self._remove(path)
+        return df
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            paths = [path for path, _ in self._disk.values()]
+            self._memory.clear()
+            self._disk.clear()
+        for path in paths:
+            self._remove(path)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._memory),
+                'bytes': sum(entry[1] for entry in self._memory.values()),
+                'spilled_entries': len(self._disk),
+                'spilled_bytes': sum(entry[1] for entry in self._disk.values()),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'spills': self.spills,
+                'evictions': self.evictions,
+            }
+
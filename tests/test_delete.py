@@ -0,0 +1,25 @@
+import sqlite3
+
+import pandas as pd
+
+from data_uploader.core import LocalSQLiteUploader
+
+
+def make_uploader(tmp_path):
+    with sqlite3.connect(tmp_path / "cars.db") as conn:
+        conn.execute("CREATE TABLE cars (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO cars VALUES (?, ?)", [(1, "a"), (2, "b")])
+    return LocalSQLiteUploader(str(tmp_path))
+
+
+def test_missing_keys_are_not_failures(tmp_path):
+    result = make_uploader(tmp_path).bulk_delete("cars", "cars", pd.DataFrame({"id": [1, 9]}), ["id"])
+    assert result["success"]
+    assert (result["rows_deleted"], result["rows_missing"], result["rows_failed"]) == (1, 1, 0)
+
+
+def test_missing_table_fails(tmp_path):
+    result = make_uploader(tmp_path).bulk_delete("cars", "nosuchtable", pd.DataFrame({"id": [1]}), ["id"])
+    assert not result["success"]
+    assert "nosuchtable" in result["error"]
+    assert result["rows_failed"] == 1
@@ -0,0 +1,33 @@
+import io
+
+from openpyxl import Workbook
+
+from data_uploader.core import encode_json_body, iter_file_chunks
+
+
+def workbook_bytes(rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    buffer.name = "cars.xlsx"
+    return buffer
+
+
+def test_blank_cell_in_text_column_stays_null():
+    upload = workbook_bytes([("id", "code"), (1, "007"), (2, None), (3, 42)])
+    df = next(iter_file_chunks(upload, column_types={"id": "INTEGER", "code": "TEXT"}))
+    assert df["code"].tolist() == ["007", None, "42"]
+    assert b'"code":null' in encode_json_body(df).replace(b" ", b"")
+
+
+def test_excel_matches_csv_for_blank_text_cells():
+    types = {"id": "INTEGER", "code": "TEXT"}
+    excel = next(iter_file_chunks(workbook_bytes([("id", "code"), (1, "a"), (2, None)]), column_types=types))
+    csv = io.BytesIO(b"id,code\n1,a\n2,\n")
+    csv.name = "cars.csv"
+    from_csv = next(iter_file_chunks(csv, column_types=types))
+    assert excel["code"].isna().tolist() == from_csv["code"].isna().tolist() == [False, True]
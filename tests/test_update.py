@@ -0,0 +1,28 @@
+import sqlite3
+
+import pandas as pd
+
+from data_uploader.core import NO_VALUE_COLUMNS, LocalSQLiteUploader
+
+
+def make_uploader(tmp_path):
+    with sqlite3.connect(tmp_path / "cars.db") as conn:
+        conn.execute("CREATE TABLE cars (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO cars VALUES (?, ?)", [(1, "a"), (2, "b")])
+    return LocalSQLiteUploader(str(tmp_path))
+
+
+def test_update_sets_values(tmp_path):
+    uploader = make_uploader(tmp_path)
+    result = uploader.bulk_update("cars", "cars", pd.DataFrame({"id": [1], "name": ["z"]}), ["id"], staged=True)
+    assert result["success"] and result["rows_updated"] == 1
+    with sqlite3.connect(tmp_path / "cars.db") as conn:
+        assert conn.execute("SELECT name FROM cars WHERE id = 1").fetchone() == ("z",)
+
+
+def test_update_with_only_key_columns_fails_clearly(tmp_path):
+    result = make_uploader(tmp_path).bulk_update("cars", "cars", pd.DataFrame({"id": [1, 2]}), ["id"], staged=True)
+    assert not result["success"]
+    assert result["error"] == NO_VALUE_COLUMNS
+    assert result["rows_failed"] == 2
+    assert list(result["status"]["error"]) == [NO_VALUE_COLUMNS] * 2
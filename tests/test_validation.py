@@ -0,0 +1,43 @@
+import io
+
+import pandas as pd
+import pytest
+
+from data_uploader.core import apply_validation, iter_file_chunks, readable_column_types, validate_rows
+
+TABLE_COLUMNS = [
+    {"name": "id", "type": "INTEGER", "notnull": 0, "pk": 1},
+    {"name": "qty", "type": "INTEGER", "notnull": 0, "pk": 0},
+    {"name": "code", "type": "TEXT", "notnull": 0, "pk": 0},
+]
+COLUMN_TYPES = {col["name"]: col["type"] for col in TABLE_COLUMNS}
+
+
+def csv_upload(text):
+    upload = io.BytesIO(text.encode())
+    upload.name = "rows.csv"
+    return upload
+
+
+def test_non_numeric_value_in_integer_column_is_reported():
+    upload = csv_upload("id,qty,code\n1,5,007\n2,abc,008\n3,7,009\n")
+    # The full hints can't parse the file at all
+    with pytest.raises(ValueError):
+        list(iter_file_chunks(upload, column_types=COLUMN_TYPES))
+
+    report = validate_rows(iter_file_chunks(upload, column_types=readable_column_types(COLUMN_TYPES)), TABLE_COLUMNS)
+    assert not report["valid"]
+    assert report["counts"] == {"wrong type": 1}
+    assert report["issues"][["row", "column", "value"]].values.tolist() == [[1, "qty", "abc"]]
+    assert report["wrong_type_columns"] == ["qty"]
+
+    # The upload is parsed without the hint that failed and cleaned per the report
+    types = readable_column_types(COLUMN_TYPES, report)
+    assert "qty" not in types
+    cleaned = pd.concat(apply_validation(iter_file_chunks(upload, column_types=types), report, "skip"))
+    assert cleaned["id"].tolist() == [1, 3]
+    assert cleaned["code"].tolist() == ["007", "009"]
+
+
+def test_readable_column_types_keeps_text_hints():
+    assert readable_column_types(COLUMN_TYPES) == {"code": "TEXT"}